@@ -0,0 +1,30 @@
+# ASGI serving mode. Serves the same Flask app (same routes) from an ASGI server:
+#   python asgi.py
+# or
+#   uvicorn asgi:app --host 0.0.0.0 --port 8080 --workers 4 --limit-concurrency 500
+# The Flask views are synchronous, so a2wsgi runs each request on a thread from a pool of
+# asgi_threads per worker, and that thread is held for the whole request, including while it waits
+# on upstream fetches (which use the same pooled sessions as the dev server). Requests in progress,
+# and so the upstream fetches they make, are capped at asgi_workers * asgi_threads (4 * 256 = 1024
+# with the defaults below). Further connections wait for a free thread, and beyond
+# asgi_limit_concurrency they get a 503. The threads mostly sleep on sockets, so raising asgi_threads
+# is the way to serve more slow requests at once, as long as there is memory for the thread stacks.
+from a2wsgi import WSGIMiddleware
+
+from main import app as flask_app
+
+asgi_host = '0.0.0.0'
+asgi_port = 8080
+# Number of worker processes
+asgi_workers = 4
+# Flask views running at once per worker: the per-worker cap on requests in progress
+asgi_threads = 256
+# Connections accepted at once per worker before responding with 503
+asgi_limit_concurrency = 500
+
+app = WSGIMiddleware(flask_app, workers=asgi_threads)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:app', host=asgi_host, port=asgi_port, workers=asgi_workers, limit_concurrency=asgi_limit_concurrency)
@@ -0,0 +1,102 @@
+import threading, time
+from collections import OrderedDict
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Simple in-memory LRU caches shared by the whole process.
+# Each named cache can be bounded by number of items and/or total size (in bytes, as reported by the caller)
+# and every entry has its own expiration time. Entries are dicts:
+#   {"value": ..., "expires": timestamp, "size": bytes, ...any extra metadata}
+
+_caches = {}
+_lock = threading.RLock()
+
+
+def init_cache(name, max_items=0, max_size=0):
+    with _lock:
+        if name not in _caches:
+            _caches[name] = {
+                "items": OrderedDict(),
+                "max_items": max_items,
+                "max_size": max_size,
+                "size": 0,
+                "stats": {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+            }
+    return _caches[name]
+
+
+def cache_count(name, stat, n=1):
+    cache = init_cache(name)
+    with _lock:
+        cache['stats'][stat] = cache['stats'].get(stat, 0) + n
+
+
+def cache_get_entry(name, key):
+    # Returns the entry even if it has expired (e.g. for revalidation), and marks it as recently used
+    cache = init_cache(name)
+    with _lock:
+        entry = cache['items'].get(key)
+        if entry:
+            cache['items'].move_to_end(key)
+        return entry
+
+
+def cache_get(name, key):
+    # Returns the cached value if it hasn't expired, otherwise None
+    entry = cache_get_entry(name, key)
+    if entry and entry['expires'] > time.time():
+        cache_count(name, 'hits')
+        return entry['value']
+    cache_count(name, 'misses')
+    return None
+
+
+def cache_set(name, key, value, ttl, size=1, **kwargs):
+    cache = init_cache(name)
+    if cache['max_size'] and size > cache['max_size']:
+        return None
+    entry = {
+        "value": value,
+        "expires": time.time() + ttl,
+        "size": size
+    }
+    entry.update(kwargs)
+    with _lock:
+        old_entry = cache['items'].pop(key, None)
+        if old_entry:
+            cache['size'] -= old_entry['size']
+        cache['items'][key] = entry
+        cache['size'] += size
+        cache['stats']['stores'] += 1
+        while cache['items'] and ((cache['max_items'] and len(cache['items']) > cache['max_items']) or (cache['max_size'] and cache['size'] > cache['max_size'])):
+            old_key, old_entry = cache['items'].popitem(last=False)
+            cache['size'] -= old_entry['size']
+            cache['stats']['evictions'] += 1
+    return entry
+
+
+def cache_delete(name, key):
+    cache = init_cache(name)
+    with _lock:
+        entry = cache['items'].pop(key, None)
+        if entry:
+            cache['size'] -= entry['size']
+
+
+def cache_clear(name):
+    cache = init_cache(name)
+    with _lock:
+        cache['items'].clear()
+        cache['size'] = 0
+
+
+def cache_stats():
+    stats = {}
+    with _lock:
+        for name, cache in _caches.items():
+            stats[name] = cache['stats'].copy()
+            stats[name]['items'] = len(cache['items'])
+            stats[name]['size'] = cache['size']
+    return stats
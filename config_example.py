@@ -38,6 +38,9 @@ verify_path = ""
 
 impersonate = "chrome"
 
+# Number of the most used feed handlers to import in the background at startup (0 imports them on first use)
+handler_prewarm_count = 0
+
 searxng_host = 'https://searx.tiekoetter.com'
 
 deno_exe = ""
@@ -1,4 +1,4 @@
-import json, re
+import re
 from bs4 import BeautifulSoup
 from datetime import datetime
 from urllib.parse import urlsplit
@@ -27,10 +27,8 @@ def get_next_data(url, site_json):
     if not next_data:
         page_html = utils.get_url_html(url, site_json=site_json)
         if page_html:
-            soup = BeautifulSoup(page_html, 'lxml')
-            el = soup.find('script', id='__NEXT_DATA__')
-            if el:
-                next_data = json.loads(el.string)
+            next_data = utils.parse_next_data(page_html)
+            if next_data:
                 if next_data['buildId'] != site_json['buildId']:
                     logger.debug('updating {} buildId'.format(split_url.netloc))
                     site_json['buildId'] = next_data['buildId']
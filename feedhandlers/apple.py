@@ -11,7 +11,7 @@ logger = logging.getLogger(__name__)
 # Apple Music API documentation
 # https://developer.apple.com/documentation/applemusicapi/
 
-def get_token():
+def fetch_token():
     js = utils.get_url_html('https://embed.podcasts.apple.com/build/web-embed.esm.js')
     if not js:
         return ''
@@ -25,6 +25,9 @@ def get_token():
     return ''
 
 
+utils.register_token('apple', fetch_token, func_load=lambda: utils.lookup_site('apple').get('token'), func_save=lambda token: utils.update_site_values('apple', {"token": token}))
+
+
 def get_apple_data(api_url, url, save_debug=False):
     s = requests.Session()
     headers = {
@@ -67,14 +70,15 @@ def get_apple_data(api_url, url, save_debug=False):
         "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.5005.124 Safari/537.36 Edg/102.0.1245.44"
     }
 
-    sites_json = utils.read_json_file('./sites.json')
-    headers['authorization'] = 'Bearer ' + sites_json['apple']['token']
-    new_token = ''
+    token = utils.get_token('apple')
+    if not token:
+        return ''
+    headers['authorization'] = 'Bearer ' + token
 
     r = s.get(api_url, headers=headers)
     if r.status_code != 200:
-        # The token might be expired, try to get a new one
-        new_token = get_token()
+        # The token might have been revoked, try to get a new one
+        new_token = utils.get_token('apple', rejected=token)
         if new_token:
             logger.debug('trying new Apple token to ' + new_token)
             headers['authorization'] = 'Bearer ' + new_token
@@ -83,10 +87,6 @@ def get_apple_data(api_url, url, save_debug=False):
     if r.status_code != 200:
         logger.warning('unexpected status code {} getting request info from {}'.format(r.status_code, url))
         return ''
-
-    if new_token:
-        sites_json['apple']['token'] = new_token
-        utils.write_file(sites_json, './sites.json')
     return r.json()
 
 
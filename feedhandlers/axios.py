@@ -1,4 +1,4 @@
-import json, re
+import re
 from bs4 import BeautifulSoup
 from datetime import datetime
 from urllib.parse import urlsplit
@@ -304,10 +304,8 @@ def get_next_data(url, site_json):
             page_html = utils.get_url_html(url, user_agent='googlecache')
             if not page_html:
                 return None
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if el:
-            next_data = json.loads(el.string)
+        next_data = utils.parse_next_data(page_html)
+        if next_data:
             if next_data['buildId'] != site_json['buildId']:
                 logger.debug('updating {} buildId'.format(split_url.netloc))
                 site_json['buildId'] = next_data['buildId']
@@ -356,12 +354,10 @@ def get_content(url, args, site_json, save_debug=False):
     else:
         if '/newsletters/' in split_url.path:
             page_html = utils.get_url_html(url)
-            soup = BeautifulSoup(page_html, 'html.parser')
-            el = soup.find('script', id='__NEXT_DATA__')
-            if not el:
+            next_data = utils.parse_next_data(page_html)
+            if not next_data:
                 logger.warning('unable to find NEXT_DATA in ' + url)
                 return None
-            next_data = json.loads(el.string)
             content_json = next_data['props']['pageProps']['data']['newsletter']
         else:
             logger.warning('unable to determine content id for ' + url)
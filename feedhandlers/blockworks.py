@@ -1,5 +1,4 @@
-import json, pytz, re
-from bs4 import BeautifulSoup
+import pytz, re
 from datetime import datetime
 from urllib.parse import quote_plus, urlsplit
 
@@ -29,12 +28,10 @@ def get_next_data(url, site_json):
     next_data = utils.get_url_json(next_url, retries=1)
     if not next_data:
         page_html = utils.get_url_html(url)
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if not el:
+        next_data = utils.parse_next_data(page_html)
+        if not next_data:
             logger.warning('unable to find __NEXT_DATA__ in ' + url)
             return None
-        next_data = json.loads(el.string)
         if next_data['buildId'] != site_json['buildId']:
             logger.debug('updating {} buildId'.format(split_url.netloc))
             site_json['buildId'] = next_data['buildId']
@@ -372,10 +372,8 @@ def get_content(url, args, site_json, save_debug):
     if page_html:
         if save_debug:
             utils.write_file(page_html, './debug/debug.html')
-        soup = BeautifulSoup(page_html, 'html.parser')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if el:
-            next_data = json.loads(el.string)
+        next_data = utils.parse_next_data(page_html)
+        if next_data:
             if save_debug:
                 utils.write_file(next_data, './debug/next.json')
             return get_item(next_data['props']['pageProps']['story'], args, site_json, save_debug)
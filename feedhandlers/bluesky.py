@@ -369,7 +369,7 @@ def make_post(post_json, is_parent=False, is_reply=False, is_quoted=False):
                 if embed['external']['uri'].startswith('https://docs.google.com/'):
                     ext_html = ''
                 else:
-                    ext_html = utils.add_embed(embed['external']['uri'])
+                    ext_html = utils.resolve_embeds(utils.add_embed(embed['external']['uri']))
                 if ext_html == '' or ext_html.startswith('<blockquote>'):
                     ext_item = {
                         "url": embed['external']['uri'],
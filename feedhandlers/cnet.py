@@ -144,8 +144,7 @@ def get_content(url, args, site_json, save_debug=False):
     if not article_html:
       return None
     if save_debug:
-      with open('./debug/debug.html', 'w', encoding='utf-8') as f:
-        f.write(article_html)
+      utils.write_file(article_html, './debug/debug.html')
     soup = BeautifulSoup(article_html, 'html.parser')
     amp_link = soup.find('link', rel='amphtml')
     if amp_link:
@@ -159,16 +158,14 @@ def get_content(url, args, site_json, save_debug=False):
   if not page_html:
     return None
   if save_debug:
-    with open('./debug/debug.html', 'w', encoding='utf-8') as f:
-      f.write(page_html)
+    utils.write_file(page_html, './debug/debug.html')
 
   soup = BeautifulSoup(page_html, 'html.parser')
 
   el = soup.find('script', attrs={"type": "application/ld+json"})
   ld_json = json.loads(el.string)
   if save_debug:
-    with open('./debug/debug.json', 'w') as file:
-      json.dump(ld_json, file, indent=4)
+    utils.write_file(ld_json, './debug/debug.json')
   if ld_json.get('review'):
     ld_info = ld_json['review']
   else:
@@ -1,4 +1,4 @@
-import json, re
+import re
 from bs4 import BeautifulSoup
 from datetime import datetime, timezone
 from urllib.parse import parse_qs, quote_plus, urlsplit
@@ -62,10 +62,8 @@ def get_content(url, args, site_json, save_debug=False):
     else:
         page_html = utils.get_url_html(url)
         if page_html:
-            soup = BeautifulSoup(page_html, 'lxml')
-            el = soup.find('script', id='__NEXT_DATA__')
-            if el:
-                next_data = json.loads(el.string)
+            next_data = utils.parse_next_data(page_html)
+            if next_data:
                 article_json = next_data['props']['pageProps']['post']
     if not article_json:
         logger.warning('unhandled url ' + url)
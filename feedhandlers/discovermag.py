@@ -16,8 +16,7 @@ def resize_image(img_src, width=1000):
 
 
 def get_next_json(url):
-    sites_json = utils.read_json_file('./sites.json')
-    next_url = 'https://www.discovermagazine.com/_next/data/' + sites_json['discovermagazine']['buildId']
+    next_url = 'https://www.discovermagazine.com/_next/data/' + utils.lookup_site('discovermagazine')['buildId']
 
     path = urlsplit(url).path
     if path.endswith('/'):
@@ -32,8 +31,7 @@ def get_next_json(url):
         article_html = utils.get_url_html(url)
         m = re.search(r'"buildId":"([^"]+)"', article_html)
         if m:
-            sites_json['discovermagazine']['buildId'] = m.group(1)
-            utils.write_file(sites_json, './sites.json')
+            utils.update_site_values('discovermagazine', {"buildId": m.group(1)})
             next_url = 'https://www.discovermagazine.com/_next/data/' + m.group(1)
             next_json = utils.get_url_json(next_url + path)
             if not next_json:
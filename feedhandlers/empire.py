@@ -1,5 +1,4 @@
-import json, re
-from bs4 import BeautifulSoup
+import re
 from datetime import datetime, timezone
 from markdown2 import markdown
 from urllib.parse import urlsplit
@@ -86,12 +85,10 @@ def get_next_data(url, save_debug=False):
     article_html = utils.get_url_html(url)
     if not article_html:
         return None
-    soup = BeautifulSoup(article_html, 'html.parser')
-    el = soup.find('script', id='__NEXT_DATA__')
-    if not el:
+    next_data = utils.parse_next_data(article_html)
+    if not next_data:
         logger.warning('unable to find __NEXT_DATA__ in ' + url)
         return None
-    next_data = json.loads(el.string)
     return next_data['props']['pageProps']
 
 
@@ -14,8 +14,7 @@ def get_content(url, args, site_json, save_debug=False):
   if not article_html:
     return None
   if save_debug:
-    with open('./debug/debug.html', 'w', encoding='utf-8') as f:
-      f.write(article_html)
+    utils.write_file(article_html, './debug/debug.html')
 
   soup = BeautifulSoup(article_html, 'html.parser')
 
@@ -55,11 +55,11 @@ def get_tokens():
 
 def get_api_content(type, value, retry=True):
     api_json = None
-    sites_json = utils.read_json_file('./sites.json')
+    fortune_json = utils.lookup_site('fortune')
 
     if type == 'page':
         split_url = urlsplit(value)
-        api_url = 'https://fortune.com/wp-json/irving/v1/components?context=page&path={}&token={}'.format(quote_plus(split_url.path), sites_json['fortune']['token'])
+        api_url = 'https://fortune.com/wp-json/irving/v1/components?context=page&path={}&token={}'.format(quote_plus(split_url.path), fortune_json['token'])
         api_json = utils.get_url_json(api_url)
 
     elif type == 'video':
@@ -72,22 +72,20 @@ def get_api_content(type, value, retry=True):
             "sec-fetch-dest": "empty",
             "sec-fetch-mode": "cors",
             "sec-fetch-site": "same-site",
-            "x-api-key": sites_json['fortune']['api_key']
+            "x-api-key": fortune_json['api_key']
         }
         api_json = utils.get_url_json('https://video-api.fortune.com/v1/public/video/{}'.format(value), headers=headers)
 
     elif type == 'historical':
-        api_url = 'https://fortune.com/wp-json/irving/v1/data/company-child-historical-results?comp_id={}&list_id={}&token={}'.format(value[0], value[1], sites_json['fortune']['token'])
+        api_url = 'https://fortune.com/wp-json/irving/v1/data/company-child-historical-results?comp_id={}&list_id={}&token={}'.format(value[0], value[1], fortune_json['token'])
         api_json = utils.get_url_json(api_url)
 
     if not api_json and retry:
         # Check for new tokens
         token, api_key = get_tokens()
-        if token != sites_json['fortune']['token'] or api_key != sites_json['fortune']['api_key']:
+        if token != fortune_json['token'] or api_key != fortune_json['api_key']:
             logger.debug('updating fortune.com tokens')
-            sites_json['fortune']['token'] = token
-            sites_json['fortune']['api_key'] = api_key
-            utils.write_file(sites_json, './sites.json')
+            utils.update_site_values('fortune', {"token": token, "api_key": api_key})
             api_json = get_api_content(type, value, False)
     return api_json
 
@@ -314,12 +312,10 @@ def get_next_data(url, site_json):
     next_data = utils.get_url_json(next_url, retries=1)
     if not next_data:
         page_html = utils.get_url_html(url)
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if not el:
+        next_data = utils.parse_next_data(page_html)
+        if not next_data:
             logger.warning('unable to find __NEXT_DATA__ in ' + url)
             return None
-        next_data = json.loads(el.string)
         if next_data['buildId'] != site_json['buildId']:
             logger.debug('updating {} buildId'.format(split_url.netloc))
             site_json['buildId'] = next_data['buildId']
@@ -506,7 +502,7 @@ def get_content(url, args, site_json, save_debug=False):
 
         lede = ''
         if article_json.get('featuredMediaType') and article_json['featuredMediaType'] == 'stn_video_media':
-            lede += utils.add_embed('https://embed.sendtonews.com/player2/embedcode.php?SC={}&autoplay=on'.format(article_json['videoId']))
+            lede += utils.resolve_embeds(utils.add_embed('https://embed.sendtonews.com/player2/embedcode.php?SC={}&autoplay=on'.format(article_json['videoId'])))
             if lede.startswith('<blockquote'):
                 lede = ''
         if not lede:
@@ -228,7 +228,7 @@ def get_item(post_json, args, site_json, save_debug):
                 new_html += '<div style="clear:left;"></div></div><div>&nbsp;</div>'
             elif 'kg-bookmark-card' in el['class']:
                 link = el.find('a', class_='kg-bookmark-container')
-                new_html = utils.add_embed(link['href'])
+                new_html = utils.resolve_embeds(utils.add_embed(link['href']))
                 if new_html.startswith('<blockquote>'):
                     new_html = '<table style="margin-left:1em; width:100%;"><tr>'
                     it = el.find(class_='kg-bookmark-thumbnail')
@@ -463,8 +463,7 @@ def get_feed(url, args, site_json, save_debug=False):
     tld = tldextract.extract(args['url'])
     split_url = urlsplit(args['url'])
     paths = list(filter(None, split_url.path[1:].split('/')))
-    sites_json = utils.read_json_file('./sites.json')
-    site_json = sites_json[tld.domain]
+    site_json = utils.lookup_site(tld.domain, split_url.netloc)
     ghost_url = '{}posts/?key={}&limit=10&page=1&include=authors%2Ctags'.format(site_json['data-api'], site_json['data-key'])
     post_filters = site_json['post_filters'].copy()
     if 'tag' in paths:
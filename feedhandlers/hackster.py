@@ -36,8 +36,7 @@ def format_content(el):
 def get_content_by_id(article_id, args, site_json, save_debug=False):
   post_data = {"t": "news_article","variables": {"id": int(article_id)}}
 
-  sites_json = utils.read_json_file('./sites.json')
-  token = sites_json['hackster']['token']
+  token = utils.lookup_site('hackster')['token']
   article_json = utils.post_url('https://api.hackster.io/graphql/query?bearer_token=' + token, json_data=post_data)
   if not article_json:
     token = get_token()
@@ -46,8 +45,7 @@ def get_content_by_id(article_id, args, site_json, save_debug=False):
     if not article_json:
       return None
     logger.debug('updating Hackster token')
-    sites_json['hackster']['token'] = token
-    utils.write_file(sites_json, './sites.json')
+    utils.update_site_values('hackster', {"token": token})
 
   if save_debug:
     utils.write_file(article_json, './debug/debug.json')
@@ -137,8 +135,7 @@ def get_feed(url, args, site_json, save_debug=False):
         post_data['variables']['by_topic_id'] = 333550
       elif m.group(1) == 'hw101':
         post_data['variables']['by_topic_id'] = 22477
-    sites_json = utils.read_json_file('./sites.json')
-    token = sites_json['hackster']['token']
+    token = utils.lookup_site('hackster')['token']
     articles_json = utils.post_url('https://api.hackster.io/graphql/query?bearer_token=' + token, json_data=post_data)
     if not articles_json or (articles_json and not articles_json['articles'].get('records')):
       token = get_token()
@@ -147,8 +144,7 @@ def get_feed(url, args, site_json, save_debug=False):
       if not articles_json:
         return None
       logger.debug('updating Hackster token')
-      sites_json['hackster']['token'] = token
-      utils.write_file(sites_json, './sites.json')
+      utils.update_site_values('hackster', {"token": token})
     if save_debug:
       utils.write_file(articles_json, './debug/feed.json')
 
@@ -22,10 +22,7 @@ def resize_image(img_src, width=1000):
 
 def get_next_json(url, build_id=''):
     if not build_id:
-        sites_json = utils.read_json_file('./sites.json')
-        build_id = sites_json['interestingengineering']['buildId']
-    else:
-        sites_json = None
+        build_id = utils.lookup_site('interestingengineering')['buildId']
     next_url = 'https://interestingengineering.com/_next/data/' + build_id
     split_url = urlsplit(url)
     if split_url.path:
@@ -40,10 +37,7 @@ def get_next_json(url, build_id=''):
         m = re.search(r'"buildId":"([^"]+)"', article_html)
         if m:
             build_id = m.group(1)
-            if not sites_json:
-                sites_json = utils.read_json_file('./sites.json')
-            sites_json['interestingengineering']['buildId'] = build_id
-            utils.write_file(sites_json, './sites.json')
+            utils.update_site_values('interestingengineering', {"buildId": build_id})
             next_json = utils.get_url_json('https://interestingengineering.com/_next/data/{}{}.json'.format(build_id, split_url.path))
             if not next_json:
                 return None
@@ -9,8 +9,7 @@ def get_content_html(url, args, post_item=None, add_title=False, save_debug=Fals
   html = ''
   if mercury:
     if save_debug:
-      with open('./debug/debug.html', 'w', encoding='utf-8') as f:
-        f.write(html)
+      utils.write_file(html, './debug/debug.html')
       
     if add_title:
       html += '<h2>{}</h2>'.format(mercury['title'])
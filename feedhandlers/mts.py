@@ -17,7 +17,7 @@ def get_content(url, args, site_json, save_debug=False):
     paths = list(filter(None, split_url.path.split('/')))
     article_id = int(paths[1])
     tld = tldextract.extract(args['url'])
-    sites_json = utils.read_json_file('./sites.json')
+    sites_json = utils.get_sites_json()
     for api_url in sites_json[tld.domain]['homepage_feed']:
         api_json = utils.get_url_json(re.sub(r'&to=\d+', '&to=20', api_url))
         article = next((it for it in api_json if it['Id'] == article_id), None)
@@ -192,7 +192,7 @@ def get_item(article_json, args, site_json, save_debug):
 
 def get_feed(url, args, site_json, save_debug=False):
     tld = tldextract.extract(args['url'])
-    sites_json = utils.read_json_file('./sites.json')
+    sites_json = utils.get_sites_json()
     portal_id = sites_json[tld.domain]['portal_id']
 
     split_url = urlsplit(args['url'])
@@ -1,5 +1,4 @@
-import json, re
-from bs4 import BeautifulSoup
+import re
 from datetime import datetime
 from urllib.parse import urlsplit
 
@@ -34,12 +33,10 @@ def _get_next_data(url, site_json):
     next_data = utils.get_url_json(next_url, retries=1)
     if not next_data:
         page_html = utils.get_url_html(url)
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if not el:
+        next_data = utils.parse_next_data(page_html)
+        if not next_data:
             logger.warning('unable to find __NEXT_DATA__ in ' + url)
             return None
-        next_data = json.loads(el.string)
         if next_data['buildId'] != build_id:
             logger.debug('updating {} buildId'.format(split_url.netloc))
             if paths[0] == 'news' or paths[0] == 'watch':
@@ -53,12 +50,10 @@ def _get_next_data(url, site_json):
 
 def get_next_data(url, site_json):
     page_html = utils.get_url_html(url)
-    soup = BeautifulSoup(page_html, 'lxml')
-    el = soup.find('script', id='__NEXT_DATA__')
-    if not el:
+    next_data = utils.parse_next_data(page_html)
+    if not next_data:
         logger.warning('unable to find __NEXT_DATA__ in ' + url)
         return None
-    next_data = json.loads(el.string)
     return next_data['props']
 
 
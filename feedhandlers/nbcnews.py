@@ -1,4 +1,4 @@
-import json, re
+import re
 import dateutil.parser
 from bs4 import BeautifulSoup
 from datetime import datetime
@@ -124,12 +124,10 @@ def render_contents(contents):
 
 def get_next_data(url):
     page_html = utils.get_url_html(url)
-    soup = BeautifulSoup(page_html, 'lxml')
-    el = soup.find('script', id='__NEXT_DATA__')
-    if not el:
+    next_data = utils.parse_next_data(page_html)
+    if not next_data:
         logger.warning('unable to find __NEXT_DATA__ in ' + url)
         return None
-    next_data = json.loads(el.string)
     return next_data
 
 
@@ -21,7 +21,7 @@ def get_feed(url, args, site_json, save_debug=False):
     # https://hudsonhubtimes-oh.newsmemory.com/eebrowser/ipad/html5.check.22033014/ajax-request.php?pSetup=hudsonhubtimes&preview=1&cc=1&action=issues&maxIssues=14&prefEdi=Hudson%20Hub%20Times
     split_url = urlsplit(args['url'])
     edition = split_url.netloc.split('.')[0]
-    sites_json = utils.read_json_file('./sites.json')
+    sites_json = utils.get_sites_json()
     edition_json = sites_json['newsmemory'][edition]
     issues_url = 'https://{}/eebrowser/ipad/html5.check.22033014/ajax-request.php?pSetup={}&preview=1&cc=1&action=issues&maxIssues=7&prefEdi={}'.format(split_url.netloc, edition_json['pSetup'], quote_plus(edition_json['title']))
     issues_json = utils.get_url_json(issues_url)
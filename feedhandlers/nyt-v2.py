@@ -472,8 +472,7 @@ def get_content(url, args, site_json, save_debug=False):
         logger.debug('skipping ' + url)
         return None
     elif paths[0] == 'athletic':
-        sites_json = utils.read_json_file('./sites.json')
-        return athletic.get_content(url, args, sites_json['theathletic'], save_debug)
+        return athletic.get_content(url, args, utils.lookup_site('theathletic'), save_debug)
     elif 'wirecutter' in paths:
         return wirecutter.get_content(url, args, site_json, save_debug)
     elif split_url.netloc == 'cooking.nytimes.com':
@@ -906,8 +905,7 @@ def get_live_feed(url, args, site_json, save_debug=False):
 
 def get_feed(url, args, site_json, save_debug=False):
     if '/athletic/' in args['url']:
-        sites_json = utils.read_json_file('./sites.json')
-        return athletic.get_feed(url, args, sites_json['theathletic'], save_debug)
+        return athletic.get_feed(url, args, utils.lookup_site('theathletic'), save_debug)
     elif '/live/' in args['url']:
         collection = get_live_feed(url, args, site_json, save_debug)
         if save_debug:
@@ -282,8 +282,7 @@ def get_feed(url, args, site_json, save_debug=False):
     if not page_html:
         return None
     if save_debug:
-        with open('./debug/debug.html', 'w', encoding='utf-8') as f:
-            f.write(page_html)
+        utils.write_file(page_html, './debug/debug.html')
 
     soup = BeautifulSoup(page_html, 'html.parser')
 
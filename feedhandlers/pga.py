@@ -1,4 +1,4 @@
-import json, re
+import re
 from bs4 import BeautifulSoup
 from datetime import datetime
 from urllib.parse import urlsplit
@@ -160,10 +160,8 @@ def get_content(url, args, site_json, save_debug=False):
         story_json = gql_data['data']['storyCollection']['items'][0]
     else:
         page_html = utils.get_url_html(url)
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if el:
-            next_data = json.loads(el.string)
+        next_data = utils.parse_next_data(page_html)
+        if next_data:
             if save_debug:
                 utils.write_file(next_data, './debug/next.json')
             for key, val in next_data['props']['apolloState'].items():
@@ -111,7 +111,7 @@ def get_content(url, args, site_json, save_debug=False):
         item['content_html'] += '<tr><td colspan="3" style="padding:0;"><div style="padding:8px;"><a href="{}" target="_blank"><img src="{}" style="display:block; width:100%;" /></a></div></td></tr>'.format(video_src, poster)
 
     elif post_json.get('secure_media'):
-        embed_html = utils.add_embed(post_json['url_overridden_by_dest'])
+        embed_html = utils.resolve_embeds(utils.add_embed(post_json['url_overridden_by_dest']))
         item['content_html'] += embed_html.replace('width:100%;', 'width:480px;')
         if post_json['secure_media']['oembed'].get('thumbnail_url'):
             item['_image'] = post_json['secure_media']['oembed']['thumbnail_url']
@@ -143,7 +143,7 @@ def get_content(url, args, site_json, save_debug=False):
 
     elif 'reddit' not in post_json['domain'] and not post_json['domain'].startswith('self.'):
         # embed_item = utils.get_content(post_json['url_overridden_by_dest'], {"embed": True}, False)
-        embed_html = utils.add_embed(post_json['url_overridden_by_dest'])
+        embed_html = utils.resolve_embeds(utils.add_embed(post_json['url_overridden_by_dest']))
         if not embed_html.startswith('<blockquote><b>Embedded content from'):
             item['content_html'] += '<tr><td colspan="3" style="padding:8px;">' + embed_html + '</td></tr>'
         elif post_json.get('preview') and post_json['preview'].get('images'):
@@ -169,7 +169,7 @@ def get_investigates_content(url, args, site_json, save_debug):
     elif el.iframe and el.iframe.has_attr('src'):
       src = el.iframe['src']
     if src:
-      new_html = utils.add_embed(src)
+      new_html = utils.resolve_embeds(utils.add_embed(src))
       if el.next_sibling.has_attr('class') and 'caption' in el.next_sibling['class']:
         if new_html.endswith('</blockquote>'):
           new_html = new_html[:-13] + '<br/><small>{}</small>'.format(utils.bs_get_inner_html(el.next_sibling))
@@ -266,8 +266,7 @@ def get_content(url, args, site_json, save_debug=False, d=''):
 
   content = url_json['result']
   if save_debug:
-    with open('./debug/debug.json', 'w') as file:
-      json.dump(content, file, indent=4)
+    utils.write_file(content, './debug/debug.json')
 
   return get_item(content, url, args, site_json, save_debug)
 
@@ -313,8 +312,7 @@ def get_feed(url, args, site_json, save_debug=False):
   if not section_json:
     return None
   if save_debug:
-    with open('./debug/feed.json', 'w') as file:
-      json.dump(section_json, file, indent=4)
+    utils.write_file(section_json, './debug/feed.json')
   
   n = 0
   items = []
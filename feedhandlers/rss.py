@@ -101,6 +101,9 @@ def get_feed(url, args, site_json, save_debug=False, func_get_content=None):
       item['date_published'] = dt.isoformat()
       item['_timestamp'] = dt.timestamp()
       item['_display_date'] = utils.format_display_date(dt)
+    if entry.get('updated_parsed'):
+      dt = datetime(*entry.updated_parsed[0:7]).replace(tzinfo=timezone.utc)
+      item['date_modified'] = dt.isoformat()
 
     # Check age
     if args.get('age'):
@@ -140,13 +143,15 @@ def get_feed(url, args, site_json, save_debug=False, func_get_content=None):
         del feed_items[i:]
 
     # Get content if a function is given
-    for i, it in enumerate(feed_items):
+    def get_item_content(it):
       if save_debug:
         logger.debug('getting content for ' + it['url'])
       if func_get_content:
-        item = func_get_content(it['url'], args, site_json, save_debug)
-      else:
-        item = utils.get_content(it['url'], args, save_debug)
+        return utils.get_cached_content(func_get_content, it['url'], args, site_json, save_debug, it.get('date_modified'))
+      return utils.get_content(it['url'], args, save_debug, it.get('date_modified'))
+
+    items = utils.expand_feed_items(feed_items, get_item_content, lambda it: it['url'], args.get('deadline'))
+    for i, item in enumerate(items):
       if item:
         # Add anything missing (except image)
         for key, val in feed_items[i].items():
@@ -11,7 +11,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def get_soundcloud_key():
+def fetch_soundcloud_key():
     pf = utils.get_url_html('https://www.pitchfork.com/reviews/albums/')
     if pf:
         soup = BeautifulSoup(pf, 'html.parser')
@@ -26,6 +26,14 @@ def get_soundcloud_key():
     return ''
 
 
+# The key isn't a JWT, so it doesn't carry its own expiry
+utils.register_token('soundcloud', fetch_soundcloud_key, ttl=24 * 3600)
+
+
+def get_soundcloud_key():
+    return utils.get_token('soundcloud')
+
+
 def get_item_info(sc_json):
     item = {}
     item['id'] = sc_json['id']
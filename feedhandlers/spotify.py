@@ -1,4 +1,4 @@
-import base64, hashlib, hmac, json, math, re
+import base64, hashlib, hmac, json, math, re, time
 import curl_cffi, requests, rnet
 from bs4 import BeautifulSoup
 from datetime import datetime
@@ -133,7 +133,7 @@ def generate_totp(timestamp: int, secret: str) -> str:
     return str(binary % (10**DIGITS)).zfill(DIGITS)
 
 
-def get_tokens(server_cfg=None):
+def fetch_tokens(server_cfg=None):
     tokens = {}
     if not server_cfg:
         server_cfg = get_server_cfg()
@@ -173,6 +173,8 @@ def get_tokens(server_cfg=None):
     access_token = r.json()
     tokens['access_token'] = access_token['accessToken']
     tokens['clientId'] = access_token['clientId']
+    if access_token.get('accessTokenExpirationTimestampMs'):
+        tokens['expires'] = access_token['accessTokenExpirationTimestampMs'] / 1000
 
     headers = {
         "accept": "application/json",
@@ -214,9 +216,21 @@ def get_tokens(server_cfg=None):
         logger.warning('invalid clienttoken response_type ' + clienttoken['response_type'])
         return None
     tokens['client_token'] = clienttoken['granted_token']['token']
+    if clienttoken['granted_token'].get('expires_after_seconds'):
+        expires = time.time() + clienttoken['granted_token']['expires_after_seconds']
+        if not tokens.get('expires') or expires < tokens['expires']:
+            tokens['expires'] = expires
     return tokens
 
 
+utils.register_token('spotify', fetch_tokens)
+
+
+def get_tokens(server_cfg=None):
+    # server_cfg is only used if the tokens need to be fetched
+    return utils.get_token('spotify', server_cfg=server_cfg)
+
+
 def get_embed_content(url, args, site_json, save_debug=False):
     split_url = urlsplit(url)
     paths = list(filter(None, split_url.path.split('/')))
@@ -526,7 +526,18 @@ def get_feed(url, args, site_json, save_debug=False):
     n = 0
     items = []
     feed = utils.init_jsonfeed(args)
+    feed_filter = utils.get_feed_filter(args)
     for post in posts_json:
+        # Check the filters against the listing before rendering the post
+        entry = {
+            "url": post['canonical_url'],
+            "title": post['title'],
+            "_timestamp": datetime.fromisoformat(post['post_date'].replace('Z', '+00:00')).timestamp()
+        }
+        if post.get('postTags'):
+            entry['tags'] = [it['name'] for it in post['postTags']]
+        if not utils.filter_item(entry, args, True):
+            continue
         if save_debug:
             logger.debug('getting content from ' + post['canonical_url'])
         item = get_post(post, args, site_json, save_debug)
@@ -534,8 +545,7 @@ def get_feed(url, args, site_json, save_debug=False):
             if utils.filter_item(item, args) == True:
                 items.append(item)
                 n += 1
-                if 'max' in args:
-                    if n == int(args['max']):
-                        break
+                if n == feed_filter['max']:
+                    break
     feed['items'] = items.copy()
     return feed
\ No newline at end of file
@@ -1,6 +1,6 @@
-import feedparser, json, re
+import calendar, feedparser, json, re
 from bs4 import BeautifulSoup
-from datetime import datetime
+from datetime import datetime, timezone
 from urllib.parse import parse_qs, quote_plus, urlsplit, unquote_plus
 
 import config, utils
@@ -99,6 +99,17 @@ def get_content(url, args, site_json, save_debug=False):
     return item
 
 
+def get_entry_summary(feed_entry):
+    # Feed entry as an item, for entries whose content isn't ready by the feed deadline
+    item = feed_entry.copy()
+    item['id'] = item['url']
+    if item.get('_timestamp'):
+        dt = datetime.fromtimestamp(item['_timestamp'], timezone.utc)
+        item['date_published'] = dt.isoformat()
+        item['_display_date'] = utils.format_display_date(dt)
+    return item
+
+
 def get_feed(url, args, site_json, save_debug=False):
     news_feed = utils.get_url_html(url)
     if not news_feed:
@@ -109,22 +120,27 @@ def get_feed(url, args, site_json, save_debug=False):
         logger.warning('Feedparser error ' + url)
         return None
 
-    n = 0
-    feed_items = []
+    entries = []
     for entry in d.entries:
         if entry.get('description'):
             m = re.search(r'href=\"([^\"]+)\"', entry.description)
             if m:
-                if save_debug:
-                    logger.debug('getting content for ' + m.group(1))
-                item = utils.get_content(m.group(1), args, save_debug)
-                if item:
-                    if utils.filter_item(item, args) == True:
-                        feed_items.append(item)
-                        n += 1
-                        if 'max' in args:
-                            if n == int(args['max']):
-                                break
+                # Check the filters against the feed entry before getting the content
+                feed_entry = {"url": m.group(1)}
+                if entry.get('title'):
+                    feed_entry['title'] = entry.title
+                if entry.get('published_parsed'):
+                    feed_entry['_timestamp'] = calendar.timegm(entry.published_parsed)
+                if utils.filter_item(feed_entry, args, True):
+                    entries.append(feed_entry)
+
+    def get_item(feed_entry):
+        if save_debug:
+            logger.debug('getting content for ' + feed_entry['url'])
+        return utils.get_content(feed_entry['url'], args, save_debug)
+
+    feed_filter = utils.get_feed_filter(args)
+    feed_items = utils.expand_feed_items(entries, get_item, lambda feed_entry: feed_entry['url'], args.get('deadline'), func_filter=lambda item: utils.filter_item(item, args), limit=feed_filter['max'], func_fallback=get_entry_summary)
     feed = utils.init_jsonfeed(args)
-    feed['items'] = sorted(feed_items, key=lambda i: i['_timestamp'], reverse=True)
+    feed['items'] = sorted([item for item in feed_items if item], key=lambda i: i.get('_timestamp', 0), reverse=True)
     return feed
@@ -194,8 +194,7 @@ def get_next_json(url):
     else:
         path = '/index.json'
 
-    sites_json = utils.read_json_file('./sites.json')
-    build_id = sites_json[tld.domain]['buildId']
+    build_id = utils.lookup_site(tld.domain)['buildId']
     next_url = '{}://{}/_next/data/{}{}'.format(split_url.scheme, split_url.netloc, build_id, path)
     next_json = utils.get_url_json(next_url, retries=1)
     if not next_json:
@@ -203,8 +202,7 @@ def get_next_json(url):
         page_html = utils.get_url_html('{}://{}'.format(split_url.scheme, split_url.netloc))
         m = re.search(r'"buildId":"([^"]+)"', page_html)
         if m:
-            sites_json[tld.domain]['buildId'] = m.group(1)
-            utils.write_file(sites_json, './sites.json')
+            utils.update_site_values(tld.domain, {"buildId": m.group(1)})
             next_url = '{}://{}/_next/data/{}{}'.format(split_url.scheme, split_url.netloc, m.group(1), path)
             next_json = utils.get_url_json(next_url)
             if not next_json:
@@ -1,5 +1,4 @@
-import json, re
-from bs4 import BeautifulSoup
+import re
 from datetime import datetime, timezone
 from urllib.parse import urlsplit
 
@@ -14,10 +13,8 @@ logger = logging.getLogger(__name__)
 def get_next_data(url, site_json):
     page_html = utils.get_url_html(url)
     if page_html:
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if el:
-            next_data = json.loads(el.string)
+        next_data = utils.parse_next_data(page_html)
+        if next_data:
             return next_data['props']
     return None
 
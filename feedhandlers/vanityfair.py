@@ -15,8 +15,7 @@ def get_feed(url, args, site_json, save_debug=False):
   if not articles:
     return None
   if save_debug:
-    with open('./debug/feed.json', 'w') as file:
-      json.dump(articles, file, indent=4)
+    utils.write_file(articles, './debug/feed.json')
 
   n = 0
   items = []
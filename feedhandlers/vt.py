@@ -1,5 +1,4 @@
-import base64, json, re
-from bs4 import BeautifulSoup
+import base64, re
 from datetime import datetime, timezone
 from urllib.parse import quote_plus, urlsplit
 
@@ -99,10 +98,8 @@ def get_feed(url, args, site_json, save_debug=False):
     next_data = utils.get_url_json(next_url, retries=1)
     if not next_data:
         page_html = utils.get_url_html(url)
-        soup = BeautifulSoup(page_html, 'lxml')
-        el = soup.find('script', id='__NEXT_DATA__')
-        if el:
-            next_data = json.loads(el.string)
+        next_data = utils.parse_next_data(page_html)
+        if next_data:
             if next_data['buildId'] != site_json['buildId']:
                 site_json['buildId'] = next_data['buildId']
                 utils.update_sites(url, site_json)
@@ -1,5 +1,4 @@
-import json, tldextract
-from bs4 import BeautifulSoup
+import tldextract
 
 from feedhandlers import fusion, rss
 import utils
@@ -13,12 +12,10 @@ def get_content(url, args, site_json, save_debug=False):
     page_html = utils.get_url_html(url)
     if not page_html:
         return None
-    soup = BeautifulSoup(page_html, 'html.parser')
-    el = soup.find('script', id='__NEXT_DATA__')
-    if not el:
+    next_data = utils.parse_next_data(page_html)
+    if not next_data:
         logger.warning('unable to find __NEXT_DATA__ in ' + url)
         return None
-    next_data = json.loads(el.string)
 
     if '/video/' in url:
         if next_data['props']['pageProps'].get('videoData'):
@@ -32,8 +29,7 @@ def get_content(url, args, site_json, save_debug=False):
         utils.write_file(content, './debug/debug.json')
 
     tld = tldextract.extract(url)
-    sites_json = utils.read_json_file('./sites.json')
-    site_json = sites_json[tld.domain]
+    site_json = utils.lookup_site(tld.domain)
 
     return fusion.get_item(content, url, args, site_json, save_debug)
 
@@ -587,7 +587,7 @@ def get_page_soup(url, site_json, save_debug=False):
     page_html = utils.get_url_html(url, site_json=site_json)
     if not page_html:
         return None
-    page_soup = BeautifulSoup(page_html, 'lxml')
+    page_soup = utils.get_soup(page_html)
     if save_debug:
         utils.write_file(page_html, './debug/page.html')
         # utils.write_file(str(page_soup), './debug/page.html')
@@ -1451,7 +1451,7 @@ def get_post_content(post, args, site_json, page_soup=None, save_debug=False):
                     else:
                         logger.warning('unable to find nxs-player-wrapper in ' + item['url'])
             else:
-                ld_json = utils.get_ld_json(item['url'])
+                ld_json = utils.get_ld_json(item['url'], soup=page_soup)
                 if save_debug:
                     utils.write_file(ld_json, './debug/ld_json.json')
                 if ld_json:
@@ -1931,25 +1931,8 @@ def format_content(content_html, item, site_json=None, module_format_content=Non
         el.extract()
 
     if site_json:
-        if site_json.get('rename'):
-            for it in site_json['rename']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.name = it['name']
-
-        if site_json.get('replace'):
-            for it in site_json['replace']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.replace_with(BeautifulSoup(it['new_html'], 'html.parser'))
-
-        if site_json.get('decompose'):
-            for it in site_json['decompose']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.decompose()
-
-        if site_json.get('unwrap'):
-            for it in site_json['unwrap']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.unwrap()
+        # rename, replace, decompose & unwrap rules
+        utils.apply_site_rules(soup, site_json)
 
     el = soup.find('body')
     if el:
@@ -5202,7 +5185,7 @@ def format_content(content_html, item, site_json=None, module_format_content=Non
         if not page_soup:
             page_html = utils.get_url_html(item['url'])
             if page_html:
-                page_soup = BeautifulSoup(page_html, 'lxml')
+                page_soup = utils.get_soup(page_html)
         if page_soup:
             it = page_soup.find('script', string=re.compile(r'wpQueryVars'))
             if not it:
@@ -5605,7 +5588,7 @@ def format_content(content_html, item, site_json=None, module_format_content=Non
             if not page_soup:
                 page_html = utils.get_url_html(item['url'])
                 if page_html:
-                    page_soup = BeautifulSoup(page_html, 'lxml')
+                    page_soup = utils.get_soup(page_html)
             if page_soup:
                 it = page_soup.find('script', string=re.compile(r'tmbi_video_settings'))
                 if it:
@@ -5939,7 +5922,7 @@ def format_content(content_html, item, site_json=None, module_format_content=Non
         if not page_soup:
             page_html = utils.get_url_html(item['url'])
             if page_html:
-                page_soup = BeautifulSoup(page_html, 'lxml')
+                page_soup = utils.get_soup(page_html)
         if page_soup:
             it = page_soup.find('script', attrs={"type": "application/ld+json"})
             if it:
@@ -6100,7 +6083,7 @@ def format_content(content_html, item, site_json=None, module_format_content=Non
                 if not page_soup:
                     page_html = utils.get_url_html(item['url'])
                     if page_html:
-                        page_soup = BeautifulSoup(page_html, 'lxml')
+                        page_soup = utils.get_soup(page_html)
                 if page_soup:
                     it = page_soup.find('script', class_='swi-linked-data', attrs={"type": "application/ld+json"})
                     if it:
@@ -7449,23 +7432,48 @@ def get_content_v2(url, args, site_json, save_debug=False):
     return item
 
 
+def get_post_entry(post):
+    # Listing metadata used to filter posts before getting their content
+    entry = {}
+    entry['url'] = post['link']
+    if post.get('title') and post['title'].get('rendered'):
+        entry['title'] = html.unescape(BeautifulSoup('<p>{}</p>'.format(post['title']['rendered']), 'html.parser').get_text())
+    if post.get('date_gmt'):
+        dt = datetime.fromisoformat(post['date_gmt']).replace(tzinfo=timezone.utc)
+        entry['_timestamp'] = dt.timestamp()
+    return entry
+
+
+def get_post_summary(post):
+    # Listing-only item, for posts whose content isn't ready by the feed deadline
+    item = get_post_entry(post)
+    item['id'] = post.get('id', post['link'])
+    if item.get('_timestamp'):
+        dt = datetime.fromtimestamp(item['_timestamp'], timezone.utc)
+        item['date_published'] = dt.isoformat()
+        item['_display_date'] = utils.format_display_date(dt)
+    if post.get('excerpt') and post['excerpt'].get('rendered'):
+        item['summary'] = BeautifulSoup(post['excerpt']['rendered'], 'html.parser').get_text().strip()
+    return item
+
+
 def get_feed(url, args, site_json, save_debug=False):
     if url.startswith(site_json['wpjson_path']):
-        n = 0
         feed = utils.init_jsonfeed(args)
         posts = utils.get_url_json(args['url'], site_json=site_json)
         if posts:
-            for post in posts:
+            posts = [post for post in posts if utils.filter_item(get_post_entry(post), args, True)]
+
+            def get_item(post):
                 if save_debug:
                     logger.debug('getting content from ' + post['link'])
-                item = get_post_content(post, args, site_json, None, save_debug)
-                if item:
-                    if utils.filter_item(item, args) == True:
-                        feed['items'].append(item)
-                        n += 1
-                        if 'max' in args:
-                            if n == int(args['max']):
-                                break
+                # Built from the listing's post, but cached under get_content so /content reuses it
+                date_modified = post['modified_gmt'] + '+00:00' if post.get('modified_gmt') else ''
+                return utils.get_cached_content(get_content, post['link'], args, site_json, save_debug, date_modified, lambda url, args, site_json, save_debug: get_post_content(post, args, site_json, None, save_debug))
+
+            feed_filter = utils.get_feed_filter(args)
+            items = utils.expand_feed_items(posts, get_item, lambda post: post['link'], args.get('deadline'), func_filter=lambda item: utils.filter_item(item, args), limit=feed_filter['max'], func_fallback=get_post_summary)
+            feed['items'] = [item for item in items if item]
     else:
         feed = rss.get_feed(url, args, site_json, save_debug, get_content)
     return feed
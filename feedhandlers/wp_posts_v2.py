@@ -2341,62 +2341,8 @@ def format_content(content_html, url, args, site_json=None, post_data=None, page
         if 'remove_nbsp_paragraphs' in site_json:
             for el in soup.find_all('p', string='\xa0'):
                 el.decompose()
-        if 'rename' in site_json:
-            for it in site_json['rename']:
-                for el in utils.get_soup_elements(it['old'], soup):
-                    if 'tag' in it['new']:
-                        el.name = it['new']['tag']
-                    if 'before' in it['new']:
-                        el.string = it['new']['before'] + el.string
-                    if 'after' in it['new']:
-                        el.string += it['new']['after']
-                    if 'attrs' in it['new']:
-                        for key, val in el.attrs.copy().items():
-                            if key == 'href' or key == 'src':
-                                continue
-                            elif 'keep_attrs' in it['old'] and key in it['old']['keep_attrs']:
-                                continue
-                            else:
-                                del el[key]
-                        for key, val in it['new']['attrs'].items():
-                            if el.get(key):
-                                el[key] = val + el[key]
-                            else:
-                                el[key] = val
-        if 'replace' in site_json:
-            for it in site_json['replace']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.replace_with(BeautifulSoup(it['new_html'], 'html.parser'))
-        if 'insert_after' in site_json:
-            for it in site_json['insert_after']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.insert_after(BeautifulSoup(it['new_html'], 'html.parser'))
-        if 'insert_before' in site_json:
-            for it in site_json['insert_before']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.insert_before(BeautifulSoup(it['new_html'], 'html.parser'))
-        if 'decompose' in site_json:
-            for it in site_json['decompose']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.decompose()
-        if 'unwrap' in site_json:
-            for it in site_json['unwrap']:
-                for el in utils.get_soup_elements(it, soup):
-                    el.unwrap()
-        if 'wrap' in site_json:
-            for it in site_json['wrap']:
-                for el in utils.get_soup_elements(it, soup):
-                    new_el = soup.new_tag(it['new']['tag'])
-                    if it['new'].get('attrs'):
-                        new_el.attrs = it['new']['attrs']
-                    el.wrap(new_el)
-        if 'clear_attrs' in site_json and isinstance(site_json['clear_attrs'], list):
-            for it in site_json['clear_attrs']:
-                for el in utils.get_soup_elements(it, soup):
-                    if el.name == 'a':
-                        el.attrs = {key: val for key, val in el.attrs.items() if key in ['href', 'target']}
-                    else:
-                        el.attrs = {}
+        # rename, replace, insert, decompose, unwrap, wrap & clear_attrs rules
+        utils.apply_site_rules(soup, site_json, ('rename', 'replace', 'insert_after', 'insert_before', 'decompose', 'unwrap', 'wrap', 'clear_attrs'))
 
     el = soup.find('body')
     if el:
@@ -1,10 +1,9 @@
-import asyncio, av, cloudscraper, curl_cffi, math, re
+import av, cloudscraper, curl_cffi, hashlib, json, math, os, re, threading, time
 from io import BytesIO
 from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageOps
-from playwright.async_api import async_playwright
 from urllib.parse import quote_plus
 
-import config, utils
+import cache_utils, config, utils
 
 import logging
 
@@ -208,57 +207,23 @@ def add_overlay(im, overlay, args):
 #
 # async_playwright in Flask example: https://stackoverflow.com/questions/47841985/make-a-python-asyncio-call-from-a-flask-route
 async def get_screenshot(url, args):
-    async with async_playwright() as playwright:
-        # Device emulation: https://playwright.dev/python/docs/emulation
-        # https://github.com/microsoft/playwright/blob/main/packages/playwright-core/src/server/deviceDescriptorsSource.json
-        if 'device' in args and args['device'] in playwright.devices:
-            device = playwright.devices[args['device']]
-            browser_name = device['default_browser_type']
-        elif 'browser' in args:
-            device = None
-            browser_name = args['browser']
-        else:
-            device = None
-            browser_name = config.default_browser
-
-        if browser_name == 'chromium' or browser_name == 'chrome':
-            engine = playwright.chromium
-            if not device:
-                device = playwright.devices['Desktop Chrome']
-        elif browser_name == 'webkit' or browser_name == 'safari':
-            engine = playwright.webkit
-            if not device:
-                device = playwright.devices['Desktop Safari']
-        elif browser_name == 'firefox':
-            engine = playwright.firefox
-            if not device:
-                device = playwright.devices['Desktop Firefox']
-        elif browser_name == 'edge':
-            engine = playwright.chromium
-            if not device:
-                device = playwright.devices['Desktop Edge']
-        else:
-            engine = playwright.chromium
-            if not device:
-                device = playwright.devices['Desktop Chrome']
-
-        if 'headed' in args:
-            headless = False
-        else:
-            headless = True
+    # Runs on the browser pool's loop: utils.run_browser_task(get_screenshot(url, args))
+    if 'device' in args:
+        device_name = args['device']
+    else:
+        device_name = ''
 
-        if browser_name == 'edge':
-            browser = await engine.launch(channel="msedge", headless=headless)
-        else:
-            browser = await engine.launch(headless=headless)
+    if 'browser' in args:
+        browser_name = args['browser']
+    else:
+        browser_name = config.default_browser
 
-        if device:
-            context = await browser.new_context(**device)
-            page = await context.new_page()
-        else:
-            context = None
-            page = await browser.new_page()
+    if 'headed' in args:
+        headless = False
+    else:
+        headless = True
 
+    async with utils.browser_page(browser_name, headless, device_name) as page:
         if 'viewport' in args:
             m = re.search(r'(\d+),(\d+)', args['viewport'])
             if m:
@@ -283,22 +248,43 @@ async def get_screenshot(url, args):
         else:
             ss = await page.screenshot()
 
-        if not ss:
-            if device:
-                await context.close()
-            await browser.close()
-            return None
-
-        im_io = BytesIO()
-        im_io.write(ss)
-        im_io.seek(0)
+    if not ss:
+        return None
 
-        if context:
-            await context.close()
-        await browser.close()
+    im_io = BytesIO()
+    im_io.write(ss)
+    im_io.seek(0)
     return im_io
 
 
+# Sources are streamed: the first image_sniff_bytes decide the format, stills are read in full up to
+# image_max_bytes and video sources are left to PyAV, which only reads what it needs from the url
+image_sniff_bytes = 512
+image_max_bytes = 50 * 1024 * 1024
+
+
+def get_image_response(img_src):
+    if 'preview.redd.it' in img_src:
+        # headers['accept'] = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+        return curl_cffi.get(img_src, impersonate="chrome", headers={"accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"}, proxies=config.proxies, stream=True)
+    elif 'truthsocial.com' in img_src:
+        logger.debug('getting truthsocial image ' + img_src)
+        # scraper = cloudscraper.create_scraper()
+        # r = scraper.get(img_src)
+        return curl_cffi.get(img_src, impersonate="chrome", stream=True)
+    return curl_cffi.get(img_src, impersonate="chrome", proxies=config.proxies, stream=True)
+
+
+def read_image_content(chunks, max_bytes, content=b''):
+    # Reads from a streamed response until max_bytes (or the end)
+    content = bytearray(content)
+    for chunk in chunks:
+        content += chunk
+        if len(content) >= max_bytes:
+            break
+    return bytes(content)
+
+
 def read_image(img_src):
     headers = {
         "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
@@ -315,32 +301,69 @@ def read_image(img_src):
         "upgrade-insecure-requests": "1",
         "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36 Edg/107.0.1418.35"
     }
-    if 'preview.redd.it' in img_src:
-        # headers['accept'] = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
-        r = curl_cffi.get(img_src, impersonate="chrome", headers={"accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"}, proxies=config.proxies)
-    elif 'truthsocial.com' in img_src:
-        print(img_src)
-        # scraper = cloudscraper.create_scraper()
-        # r = scraper.get(img_src)
-        r = curl_cffi.get(img_src, impersonate="chrome")
-    else:
-        r = curl_cffi.get(img_src, impersonate="chrome", proxies=config.proxies)
-    if r.status_code != 200:
-        logger.warning('status code {} getting {}'.format(r.status_code, img_src))
+    r = get_image_response(img_src)
+    try:
+        if r.status_code != 200:
+            logger.warning('status code {} getting {}'.format(r.status_code, img_src))
+            return None
+        img_content = read_image_content(r.iter_content(), image_max_bytes)
+    finally:
+        r.close()
+    if len(img_content) >= image_max_bytes:
+        logger.warning('image too large ' + img_src)
         return None
-    else:
-        img_content = r.content
 
     # if 'www.cbc.ca' in img_src:
     #     img_content = utils.get_url_content(img_src, headers=headers, use_proxy=True, use_curl_cffi=True)
     # else:
     #     img_content = utils.get_url_content(img_src, headers=headers)
 
-    # im = None
-    if img_content:
-        im_io = BytesIO(img_content)
-        # im = Image.open(im_io)
-    return im_io
+    if not img_content:
+        return None
+    return BytesIO(img_content)
+
+
+def sniff_media_type(data):
+    # Returns 'image', 'video', 'playlist' or '' from the first bytes of a file
+    data = bytes(data)
+    if data.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM', b'II*\x00', b'MM\x00*')):
+        return 'image'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'image'
+    if data[4:8] == b'ftyp':
+        if data[8:12] in [b'avif', b'avis', b'heic', b'heix', b'mif1', b'msf1']:
+            return 'image'
+        return 'video'
+    if data.startswith(b'\x1a\x45\xdf\xa3'):
+        # webm/mkv
+        return 'video'
+    if data.startswith(b'\x00\x00\x01\xba') or (len(data) > 188 and data[0] == 0x47 and data[188] == 0x47):
+        # mpeg-ps/mpeg-ts
+        return 'video'
+    text = data.lstrip().lower()
+    if text.startswith(b'#extm3u') or (text.startswith(b'<?xml') and b'<mpd' in text) or text.startswith(b'<mpd'):
+        return 'playlist'
+    return ''
+
+
+# Decoded poster frames of video sources, by url
+poster_frame_ttl = 24 * 3600
+poster_frame_live_ttl = 300
+cache_utils.init_cache('poster_frames', max_size=128 * 1024 * 1024)
+
+
+def get_poster_frame(container):
+    stream = container.streams.video[0]
+    stream.codec_context.skip_frame = "NONKEY"
+    for frame in container.decode(stream):
+        if frame.width > frame.height:
+            w = 1280
+            h = int(frame.height * w / frame.width)
+        else:
+            h = 800
+            w = int(frame.width * h / frame.height)
+        return frame.reformat(width=w, height=h).to_image()
+    return None
 
 
 def get_image(args, im=None, im_io=None):
@@ -353,58 +376,87 @@ def get_image(args, im=None, im_io=None):
         im = Image.open(im_io)
     elif not im:
         if 'url' in img_args:
-            container = None
             img_src = img_args['url']
+            poster = cache_utils.cache_get('poster_frames', img_src)
+            if poster:
+                im = poster.copy()
+                save = True
+                img_src = ''
             while img_src:
                 container = None
                 try:
-                    container = av.open(img_src)
-                except (av.error.HTTPForbiddenError, av.error.InvalidDataError):
-                    im_io = read_image(img_src)
-                    if im_io:
-                        container = av.open(im_io)
-                if container:
+                    # Sniff the format from the content type or the first bytes, then read the rest only for stills
+                    media_type = ''
+                    r = get_image_response(img_src)
                     try:
-                        if re.search(r'dash|hls|mp4|m4a|mov|mpeg|webm', container.format.name):
-                            stream = container.streams.video[0]
-                            stream.codec_context.skip_frame = "NONKEY"
-                            for frame in container.decode(stream):
-                                if frame.width > frame.height:
-                                    w = 1280
-                                    h = int(frame.height * w / frame.width)
-                                else:
-                                    h = 800
-                                    w = int(frame.width * h / frame.height)
-                                im = frame.reformat(width=w, height=h).to_image()
-                                # im = frame.to_image()
+                        if r.status_code == 403:
+                            if '/proxy/' not in img_src:
+                                img_src = config.server + '/proxy/' + img_args['url']
+                            else:
+                                img_src = ''
+                            continue
+                        elif r.status_code != 200:
+                            logger.warning('status code {} getting {}'.format(r.status_code, img_src))
+                            break
+                        content_type = r.headers.get('content-type', '').lower()
+                        if 'mpegurl' in content_type or 'dash+xml' in content_type:
+                            media_type = 'playlist'
+                        elif content_type.startswith(('video/', 'audio/')):
+                            media_type = 'video'
+                        else:
+                            chunks = r.iter_content()
+                            img_content = read_image_content(chunks, image_sniff_bytes)
+                            media_type = sniff_media_type(img_content[:image_sniff_bytes])
+                        if media_type == 'image':
+                            img_content = read_image_content(chunks, image_max_bytes, img_content)
+                            if len(img_content) >= image_max_bytes:
+                                logger.warning('image too large ' + img_src)
                                 break
+                            im_io = BytesIO(img_content)
+                    finally:
+                        r.close()
+                    if media_type == 'image':
+                        try:
+                            im = Image.open(im_io)
+                            mimetype = im.get_format_mimetype()
+                        except Exception:
+                            # e.g. avif/heic without a PIL plugin
+                            im_io.seek(0)
+                            container = av.open(im_io)
+                    else:
+                        # Videos and playlists: PyAV streams from the url (with range requests) and only reads
+                        # what it needs for the first keyframe; playlist segments are relative to the url too
+                        container = av.open(img_src)
+                    if container:
+                        if re.search(r'dash|hls|mp4|m4a|mov|mpeg|webm|matroska', container.format.name):
+                            im = get_poster_frame(container)
+                            if im:
+                                # Live playlists change, so only keep their frames briefly
+                                ttl = poster_frame_live_ttl if media_type == 'playlist' else poster_frame_ttl
+                                cache_utils.cache_set('poster_frames', img_args['url'], im.copy(), ttl, size=im.width * im.height * len(im.getbands()))
                             save = True
                         elif re.search(r'image|jpeg|png|webp', container.format.name):
-                            if not im_io:
-                                im_io = read_image(img_src)
-                            if im_io:
-                                im = Image.open(im_io)
-                                mimetype = im.get_format_mimetype()
-                        img_src = ''
-                    except av.HTTPForbiddenError:
-                        if '/proxy/' not in img_src:
-                            img_src = config.server + '/proxy/' + img_args['url']
-                        else:
-                            img_src = ''
-                    except av.error.InvalidDataError:
-                        if re.search(r'\.(mp4|m4a|mov|mpeg|webm)', img_args['url']):
-                            loop = asyncio.ProactorEventLoop()
-                            asyncio.set_event_loop(loop)
-                            im_io = loop.run_until_complete(get_screenshot(img_args['url'], img_args))
-                            if im_io:
-                                im = Image.open(im_io)
-                                img_args['cropbbox'] = '0'
-                        img_src = ''
-                    except Exception as e:
-                        logger.warning('image exception: ' + str(e))
+                            frame = next(container.decode(video=0))
+                            im = frame.to_image()
+                            save = True
+                    img_src = ''
+                except av.HTTPForbiddenError:
+                    if '/proxy/' not in img_src:
+                        img_src = config.server + '/proxy/' + img_args['url']
+                    else:
                         img_src = ''
-                    if container:
-                        container.close()
+                except av.error.InvalidDataError:
+                    if re.search(r'\.(mp4|m4a|mov|mpeg|webm)', img_args['url']):
+                        im_io = utils.run_browser_task(get_screenshot(img_args['url'], img_args))
+                        if im_io:
+                            im = Image.open(im_io)
+                            img_args['cropbbox'] = '0'
+                    img_src = ''
+                except Exception as e:
+                    logger.warning('image exception: ' + str(e))
+                    img_src = ''
+                if container:
+                    container.close()
 
     if not im:
         if 'url' in img_args and re.search(r'\.(mp4|m4a|mov|mpeg|webm)', img_args['url']):
@@ -543,6 +595,152 @@ def get_image(args, im=None, im_io=None):
     return im_io, mimetype
 
 
+# On-disk cache of processed images for the /image endpoint.
+# Files are named by a hash of the source url and the transform args (in order, since get_image applies them in order).
+# The file's atime is used for LRU eviction and its mtime for expiration and the ETag.
+image_cache_dir = './image_cache'
+image_cache_max_size = 512 * 1024 * 1024
+image_cache_ttl = 7 * 24 * 3600
+image_cache_ignore_args = ['debug', 'nocache']
+image_cache_exts = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/avif": "avif"
+}
+_image_cache = {
+    "size": -1,
+    "stats": {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+}
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache_key(args):
+    key_args = []
+    for arg, val in args.items():
+        if arg in image_cache_ignore_args:
+            continue
+        val = val.strip()
+        if arg == 'url':
+            val = utils.normalize_url(val)
+        elif arg in ['crop', 'color', 'letterbox', 'border', 'viewport']:
+            val = re.sub(r'\s', '', val).lower()
+        key_args.append([arg, val])
+    return hashlib.sha256(json.dumps(key_args).encode()).hexdigest()
+
+
+def get_image_cache_path(key, mimetype=''):
+    # Returns the path of the cached file (any extension) if mimetype is not given
+    key_dir = os.path.join(image_cache_dir, key[:2])
+    if mimetype:
+        return os.path.join(key_dir, '{}.{}'.format(key, image_cache_exts[mimetype]))
+    if os.path.isdir(key_dir):
+        for ext in set(image_cache_exts.values()):
+            path = os.path.join(key_dir, '{}.{}'.format(key, ext))
+            if os.path.isfile(path):
+                return path
+    return ''
+
+
+def get_image_cache_etag(key, st):
+    return '{}-{:x}'.format(key[:32], st.st_mtime_ns)
+
+
+def get_cached_image(args):
+    # Returns (path, mimetype, etag) of the processed image, or (None, error message, None)
+    if 'nocache' in args or 'url' not in args:
+        im_io, mimetype = get_image(args)
+        return im_io, mimetype, None
+
+    key = get_image_cache_key(args)
+    path = get_image_cache_path(key)
+    if path:
+        try:
+            st = os.stat(path)
+            if st.st_mtime + image_cache_ttl > time.time():
+                # Mark as recently used for eviction
+                os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+                with _image_cache_lock:
+                    _image_cache['stats']['hits'] += 1
+                ext = os.path.splitext(path)[1][1:]
+                mimetype = next(k for k, v in image_cache_exts.items() if v == ext)
+                return os.path.abspath(path), mimetype, get_image_cache_etag(key, st)
+        except OSError:
+            pass
+
+    with _image_cache_lock:
+        _image_cache['stats']['misses'] += 1
+    im_io, mimetype = get_image(args)
+    if not im_io or mimetype not in image_cache_exts:
+        return im_io, mimetype, None
+
+    data = im_io.getvalue()
+    new_path = get_image_cache_path(key, mimetype)
+    try:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(new_path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, new_path)
+        if path and path != new_path:
+            os.remove(path)
+        st = os.stat(new_path)
+    except OSError as e:
+        logger.warning('error {} writing image cache file {}'.format(e.__class__.__name__, new_path))
+        return im_io, mimetype, None
+
+    with _image_cache_lock:
+        _image_cache['stats']['stores'] += 1
+        if _image_cache['size'] >= 0:
+            _image_cache['size'] += len(data)
+        prune = _image_cache['size'] < 0 or _image_cache['size'] > image_cache_max_size
+    if prune:
+        prune_image_cache()
+    return os.path.abspath(new_path), mimetype, get_image_cache_etag(key, st)
+
+
+def prune_image_cache():
+    # Removes expired files, then the least recently used files until the cache fits in image_cache_max_size
+    with _image_cache_lock:
+        files = []
+        total_size = 0
+        now = time.time()
+        for root, dirs, filenames in os.walk(image_cache_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                    if st.st_mtime + image_cache_ttl < now or (filename.endswith('.tmp') and st.st_mtime + 60 < now):
+                        os.remove(path)
+                        _image_cache['stats']['evictions'] += 1
+                        continue
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, path))
+                total_size += st.st_size
+        if total_size > image_cache_max_size:
+            # Prune down to 90% so that every store doesn't trigger a full scan
+            for atime, size, path in sorted(files):
+                if total_size <= 0.9 * image_cache_max_size:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                    _image_cache['stats']['evictions'] += 1
+                except OSError:
+                    pass
+        _image_cache['size'] = total_size
+
+
+def get_image_cache_stats():
+    with _image_cache_lock:
+        stats = _image_cache['stats'].copy()
+        stats['size'] = _image_cache['size']
+    return stats
+
+
 # def text(s):
 #     WIDTH = 3
 #     HEIGHT = 2
@@ -572,6 +770,15 @@ def get_image(args, im=None, im_io=None):
 #     surface.write_to_png('text.png')
 
 
+def get_thumbnail_size(size, box):
+    # The size Image.thumbnail(box) would produce, without decoding the image
+    w, h = size
+    if w <= box[0] and h <= box[1]:
+        return size
+    scale = min(box[0] / w, box[1] / h)
+    return max(round(w * scale), 1), max(round(h * scale), 1)
+
+
 # https://github.com/delimitry/collage_maker/blob/master/collage_maker.py
 def make_collage(args):
     """
@@ -603,6 +810,21 @@ def make_collage(args):
     else:
         n_max = 6
 
+    # fetch all the images concurrently, once, and keep only their dimensions for the layout
+    img_paths = list(dict.fromkeys(images))
+    img_buffers = {}
+    img_sizes = {}
+    for img_path, im_io in zip(img_paths, utils.get_feed_executor().map(read_image, img_paths)):
+        if not im_io:
+            continue
+        try:
+            # Image.open only reads the header
+            with Image.open(im_io) as img:
+                img_sizes[img_path] = img.size
+            img_buffers[img_path] = im_io
+        except Exception as e:
+            logger.warning('unable to open {}: {}'.format(img_path, e))
+
     # run until a suitable arrangement of images is found
     while True:
         # copy images to images_list
@@ -614,18 +836,16 @@ def make_collage(args):
         while images_list and n < n_max:
             # get first image and resize to `init_height`
             img_path = images_list.pop(0)
-            im_io = read_image(img_path)
-            if not im_io:
+            if img_path not in img_sizes:
                 logger.warning('unable to open ' + img_path)
                 continue
-            img = Image.open(im_io)
-            img.thumbnail((width, init_height))
+            img_size = get_thumbnail_size(img_sizes[img_path], (width, init_height))
             # when `x` will go beyond the `width`, start the next line
             if x > width:
                 coefs_lines.append((float(x) / width, images_line))
                 images_line = []
                 x = 0
-            x += img.size[0] + margin_size
+            x += img_size[0] + margin_size
             images_line.append(img_path)
             n += 1
         # finally add the last line with images
@@ -656,13 +876,15 @@ def make_collage(args):
         if imgs_line:
             x = 0
             for img_path in imgs_line:
-                # img = Image.open(img_path)
-                img = Image.open(read_image(img_path))
+                img_buffers[img_path].seek(0)
+                img = Image.open(img_buffers[img_path])
                 # if need to enlarge an image - use `resize`, otherwise use `thumbnail`, it's faster
                 k = (init_height / coef) / img.size[1]
                 if k > 1:
                     img = img.resize((int(img.size[0] * k), int(img.size[1] * k)), Image.LANCZOS)
                 else:
+                    # for jpegs, let the decoder downscale (by a power of 2) while decoding
+                    img.draft('RGB', (int(width / coef), int(init_height / coef)))
                     img.thumbnail((int(width / coef), int(init_height / coef)), Image.LANCZOS)
                 if collage_image:
                     collage_image.paste(img, (int(x), int(y)))
@@ -1,4 +1,4 @@
-import asyncio, curl_cffi, base64, glob, importlib, io, json, os, random, re, requests, string, subprocess, sys
+import curl_cffi, base64, glob, importlib, io, json, os, random, re, requests, string, subprocess, sys
 import logging, logging.handlers
 
 # TODO: use fastapi?
@@ -9,8 +9,7 @@ from io import BytesIO
 from staticmap import StaticMap, CircleMarker
 from urllib.parse import quote, quote_plus, urlsplit
 
-import config, image_utils, utils
-from feedhandlers import google, spotify
+import cache_utils, config, image_utils, utils
 
 app = Flask(__name__)
 CORS(app)
@@ -39,6 +38,15 @@ logging.getLogger('oauthlib').setLevel(logging.WARNING)
 logging.getLogger('duckduckgo_search').setLevel(logging.WARNING)
 #logging.getLogger('flask_cors').setLevel(logging.DEBUG)
 
+# Import the most used feed handlers in the background (see config.handler_prewarm_count)
+utils.prewarm_handlers()
+
+
+@app.before_request
+def start_debug():
+    # Debug files are only written for requests with the debug arg
+    utils.start_debug_request('debug' in request.args)
+
 
 @app.template_filter()
 def make_thumbnail(img_src):
@@ -131,7 +139,7 @@ def content():
         args_copy.update(site_json['args'])
 
 
-    content = module.get_content(url, args_copy, site_json, save_debug)
+    content = utils.get_cached_content(module.get_content, url, args_copy, site_json, save_debug)
 
     if 'ai_summary' in args:
         if args['ai_summary'] in ['cloudflare', 'hf_summarizer', 'decopy_ai']:
@@ -400,9 +408,12 @@ def debug():
 
 @app.route('/image')
 def image():
-    im_io, mimetype = image_utils.get_image(request.args)
-    if im_io:
-        return send_file(im_io, mimetype=mimetype)
+    im, mimetype, etag = image_utils.get_cached_image(request.args)
+    if im and etag:
+        # Served from the image cache file, send_file handles If-None-Match (304)
+        return send_file(im, mimetype=mimetype, etag=etag, conditional=True, max_age=image_utils.image_cache_ttl)
+    elif im:
+        return send_file(im, mimetype=mimetype)
     return mimetype
 
 
@@ -522,10 +533,7 @@ def screenshot():
     if 'url' not in args:
         return 'No url specified'
 
-    # # https://github.com/microsoft/playwright-python/issues/723
-    loop = asyncio.ProactorEventLoop()
-    asyncio.set_event_loop(loop)
-    im_io = loop.run_until_complete(image_utils.get_screenshot(args['url'], args))
+    im_io = utils.run_browser_task(image_utils.get_screenshot(args['url'], args))
     mimetype = 'image/png'
     if im_io and len(args) > 1:
         im_io, mimetype = image_utils.get_image(args, im_io=im_io)
@@ -639,9 +647,32 @@ def send_src():
     f_io = BytesIO(r.content)
     return send_file(f_io, mimetype='text/html')
 
+# Upstream headers passed through by the proxy, so that seeking (range requests) and revalidation work
+proxy_request_headers = ['range', 'if-range', 'if-none-match', 'if-modified-since']
+proxy_response_headers = ['content-type', 'content-length', 'content-range', 'accept-ranges', 'etag', 'last-modified', 'cache-control', 'expires']
+# (connect, read) timeouts for upstream requests. The read timeout applies between chunks, so a stalled upstream is dropped
+proxy_timeout = (10, 30)
+
+
+def iter_proxy_content(r, chunk_size=64 * 1024, max_chunk_size=1024 * 1024):
+    # Start with small chunks for a quick first byte, then grow them for throughput
+    buf = bytearray()
+    try:
+        for data in r.iter_content(chunk_size=chunk_size):
+            buf += data
+            if len(buf) >= chunk_size:
+                yield bytes(buf)
+                buf.clear()
+                chunk_size = min(chunk_size * 2, max_chunk_size)
+        if buf:
+            yield bytes(buf)
+    finally:
+        r.close()
+
+
 # This is to bypass video content restricted by CORS (Access-Control-Allow-Origin) headers
 # https://github.com/ChopsKingsland/cors-proxy/blob/master/app.py
-@app.route('/<path:url>', methods=['GET'])
+@app.route('/<path:url>', methods=['GET', 'HEAD'])
 def proxy(url):
     m = re.search(r'^https?://[^/]+/proxy/(.*)', request.url)
     if not m:
@@ -652,7 +683,7 @@ def proxy(url):
 
     if 'drive.google.com/' in proxy_url:
         # Google drive videos need to be requested with the headers & cookies
-        content = google.get_content(proxy_url, {}, {"module": "google"}, False)
+        content = utils.get_handler('google').get_content(proxy_url, {}, {"module": "google"}, False)
         if content and '_video' in content:
             proxy_url = content['_video']
             if '_video_headers' in content:
@@ -687,45 +718,76 @@ def proxy(url):
         }
         proxy_url = proxy_url.replace('tt_chain_token_' + token, 'tk')
 
-    if '.m3u8' in proxy_url and not proxy_url.endswith('.ts'):
-        # This doen't reliably work for youtube m3u8 urls. They return 403 for methods here, but work fine in the console or module
-        # r = requests.get(proxy_url, headers=headers)
-        if 'manifest.googlevideo.com/api' in proxy_url:
-            r = curl_cffi.get(proxy_url, impersonate='safari', proxies=config.proxies)
-        elif 'cdn.rasset.ie' in proxy_url:
-            r = curl_cffi.get(proxy_url, impersonate='chrome')
-        elif headers:
-            # r = curl_cffi.get(proxy_url, headers=headers, impersonate=config.impersonate, proxies=config.proxies)
-            r = requests.get(proxy_url, headers=headers)
-        else:
+    if ('.m3u8' in proxy_url and not proxy_url.endswith('.ts')) or re.search(r'\.mpd\b', proxy_url):
+        def get_manifest(manifest_url):
+            # This doen't reliably work for youtube m3u8 urls. They return 403 for methods here, but work fine in the console or module
+            # r = requests.get(proxy_url, headers=headers)
+            if 'manifest.googlevideo.com/api' in manifest_url:
+                return curl_cffi.get(manifest_url, impersonate='safari', proxies=config.proxies, timeout=proxy_timeout)
+            elif 'cdn.rasset.ie' in manifest_url:
+                return curl_cffi.get(manifest_url, impersonate='chrome', timeout=proxy_timeout)
+            elif headers:
+                # r = curl_cffi.get(proxy_url, headers=headers, impersonate=config.impersonate, proxies=config.proxies)
+                return requests.get(manifest_url, headers=headers, timeout=proxy_timeout)
             # r = curl_cffi.get(proxy_url, impersonate=config.impersonate, proxies=config.proxies)
-            r = requests.get(proxy_url)
-        if r.status_code != 200:
-            logger.warning('requests error {} getting {}'.format(r.status_code, proxy_url))
-            if r.text:
-                f_io = BytesIO(r.text.encode())
-                return send_file(f_io, mimetype='text/plain'), r.status_code
-            return 'Something went wrong ({})'.format(r.status_code), r.status_code
-        m3u8_playlist = r.text
+            return requests.get(manifest_url, timeout=proxy_timeout)
         # Rewrite playlist files to proxy the contents
-        if 'cdn.rasset.ie' in proxy_url:
-            m3u8_playlist = m3u8_playlist.replace('/hls-vod', config.server + '/proxy/https://cdn.rasset.ie/hls-vod')
-        else:
-            m3u8_playlist = m3u8_playlist.replace('https://', config.server + '/proxy/https://')
-        f_io = BytesIO(m3u8_playlist.encode())
+        manifest, status_code = utils.get_proxy_manifest(proxy_url, get_manifest)
+        if status_code != 200:
+            if manifest:
+                f_io = BytesIO(manifest.encode())
+                return send_file(f_io, mimetype='text/plain'), status_code
+            return 'Something went wrong ({})'.format(status_code), status_code
+        f_io = BytesIO(manifest.encode())
+        if manifest.lstrip().startswith('<'):
+            return send_file(f_io, mimetype='application/dash+xml')
         return send_file(f_io, mimetype='text/plain')
 
-    # r = requests.get(proxy_url, headers=headers, stream=True)
-    if 'static-assets-1.truthsocial.com':
-        r = curl_cffi.get(proxy_url, impersonate=config.impersonate, stream=True)
-    elif headers:
-        r = curl_cffi.get(proxy_url, headers=headers, impersonate=config.impersonate, proxies=config.proxies, stream=True)
+    if headers:
+        req_headers = headers.copy()
+    else:
+        req_headers = {}
+    for key in proxy_request_headers:
+        if request.headers.get(key):
+            req_headers[key] = request.headers[key]
+    # curl_cffi opens a new connection for every streamed response, so use the pooled requests session
+    # (connections to the same host are reused) except for hosts that need the browser fingerprint
+    if 'static-assets-1.truthsocial.com' in proxy_url:
+        backend = 'curl_cffi'
+        session = utils.get_http_session(backend, False, True, 0)
     else:
-        r = curl_cffi.get(proxy_url, impersonate=config.impersonate, proxies=config.proxies, stream=True)
-    # Note on chunk size: https://stackoverflow.com/questions/34229349/flask-streaming-file-with-stream-with-context-is-very-slow
-    resp = Response(stream_with_context(r.iter_content(chunk_size=1024)), status=r.status_code)
-    resp.headers['Content-Type'] = r.headers['content-type']
+        backend = 'requests'
+        session = utils.get_http_session(backend, True, True, 0)
+        if not any(key.lower() == 'user-agent' for key in req_headers):
+            req_headers['user-agent'] = utils.get_pool_headers('desktop')['User-Agent']
+    try:
+        r = session.request(request.method, proxy_url, headers=req_headers, stream=True, allow_redirects=True, timeout=proxy_timeout)
+    except Exception as e:
+        logger.warning('proxy error {} getting {}'.format(e.__class__.__name__, proxy_url))
+        utils.release_http_session(backend, session, False, True)
+        return 'Something went wrong ({})'.format(e.__class__.__name__), 502
+
+    def close_upstream():
+        r.close()
+        # The curl_cffi session is busy until its stream is closed
+        utils.release_http_session(backend, session, False, True)
+
+    if request.method == 'HEAD':
+        close_upstream()
+        resp = Response(status=r.status_code)
+    else:
+        # Note on chunk size: https://stackoverflow.com/questions/34229349/flask-streaming-file-with-stream-with-context-is-very-slow
+        resp = Response(stream_with_context(iter_proxy_content(r)), status=r.status_code)
+        # Release the upstream connection even if the client disconnects before the stream starts
+        resp.call_on_close(close_upstream)
+    for key in proxy_response_headers:
+        if key == 'content-length' and r.headers.get('content-encoding'):
+            # curl decompresses the content, so the upstream length is wrong
+            continue
+        if r.headers.get(key):
+            resp.headers[key] = r.headers[key]
     resp.headers['Access-Control-Allow-Origin'] = '*'
+    resp.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
     return resp
 
 
@@ -740,14 +802,14 @@ def stream_spotify():
     content_type = paths[-2]
     if content_type != 'episode':
         return 'Content not supported'
-    tokens = spotify.get_tokens()
+    tokens = utils.get_handler('spotify').get_tokens()
     if not tokens:
         return 'unable to get Spotify access tokens'
 
     headers = {
         "accept": "application/json",
         "accept-language": "en-US,en;q=0.9,en-GB;q=0.8",
-        "authorization": 'Bearer ' + tokens['access_token']['accessToken'],
+        "authorization": 'Bearer ' + tokens['access_token'],
         "content-type": "application/json",
         "origin": "https://open.spotify.com",
         "priority": "u=1, i",
@@ -792,7 +854,7 @@ def stream_spotify():
         else:
             key = args['key']
     else:
-        key = spotify.get_key(widevine['fileId'])
+        key = utils.get_handler('spotify').get_key(widevine['fileId'])
 
     # TODO: play with videojs-contrib-eme or shaka-player?
 
@@ -871,13 +933,11 @@ def stock_chart():
     else:
         save_debug = False
     if 'output' in args and args['output'] == 'png':
-        loop = asyncio.ProactorEventLoop()
-        asyncio.set_event_loop(loop)
         url = config.server + '/stock_chart?'
         if save_debug:
             url += 'debug&'
         url += '&symbol=' + args['symbol']
-        im_io = loop.run_until_complete(image_utils.get_screenshot(url, {}))
+        im_io = utils.run_browser_task(image_utils.get_screenshot(url, {}))
         if im_io:
             im_io, mimetype = image_utils.get_image({'cropbbox': '1'}, im_io=im_io)
             if im_io:
@@ -888,6 +948,19 @@ def stock_chart():
     return Response(chart_svg, mimetype="image/svg+xml")
 
 
+@app.route('/stats')
+def stats():
+    # Connection reuse and cache hit/miss counters
+    return jsonify({
+        "http": utils.get_http_stats(),
+        "caches": cache_utils.cache_stats(),
+        "image_cache": image_utils.get_image_cache_stats(),
+        "redirects": utils.get_redirect_cache_stats(),
+        "tokens": utils.get_token_stats(),
+        "handler_import_times": utils.get_handler_import_times()
+    })
+
+
 @app.route('/')
 def home():
     args = request.args
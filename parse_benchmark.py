@@ -0,0 +1,66 @@
+# Compares HTML parse times per handler family:
+#   python parse_benchmark.py url [url ...]
+#   python parse_benchmark.py -f urls.txt
+# Each page is fetched once and then parsed with BeautifulSoup (html.parser and lxml) and with the
+# selector-only metadata path (utils.get_page_meta). Times are the median of --repeat runs, in ms.
+import argparse, statistics, time
+from bs4 import BeautifulSoup
+
+import utils
+
+
+def time_parse(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+
+def get_family(url):
+    site_json = utils.get_site_json(url)
+    if site_json and site_json.get('module'):
+        return site_json['module']
+    return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare HTML parse times per handler family')
+    parser.add_argument('urls', nargs='*')
+    parser.add_argument('-f', '--file', help='file with one url per line')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    urls = list(args.urls)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not urls:
+        parser.error('no urls given')
+
+    families = {}
+    for url in urls:
+        page_html = utils.get_url_html(url)
+        if not page_html:
+            print('unable to get ' + url)
+            continue
+        results = {
+            "size": len(page_html),
+            "html.parser": time_parse(lambda: BeautifulSoup(page_html, 'html.parser'), args.repeat),
+            "lxml": time_parse(lambda: BeautifulSoup(page_html, 'lxml'), args.repeat),
+            "meta": time_parse(lambda: utils.parse_page_meta(page_html), args.repeat)
+        }
+        families.setdefault(get_family(url), []).append(results)
+
+    print('{:<20} {:>5} {:>9} {:>12} {:>9} {:>9} {:>8}'.format('family', 'pages', 'avg KB', 'html.parser', 'lxml', 'meta', 'speedup'))
+    for family, results in sorted(families.items()):
+        size = statistics.mean(it['size'] for it in results) / 1024
+        html_parser = statistics.mean(it['html.parser'] for it in results)
+        lxml = statistics.mean(it['lxml'] for it in results)
+        meta = statistics.mean(it['meta'] for it in results)
+        print('{:<20} {:>5} {:>9.1f} {:>12.2f} {:>9.2f} {:>9.2f} {:>7.1f}x'.format(family, len(results), size, html_parser, lxml, meta, html_parser / lxml))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+from bs4 import BeautifulSoup
+
+import utils
+
+
+def apply_rules_in_turn(soup, site_json):
+    # The rule-by-rule loop the compiled programs have to match
+    for phase in utils.soup_program_phases:
+        for it in site_json.get(phase, []):
+            for el in utils.get_soup_elements(it, soup):
+                if phase == 'rename':
+                    el.name = it['name']
+                elif phase == 'replace':
+                    el.replace_with(BeautifulSoup(it['new_html'], 'html.parser'))
+                elif phase == 'decompose':
+                    el.decompose()
+                elif phase == 'unwrap':
+                    el.unwrap()
+    return soup
+
+
+def check_site_rules(site_json, html):
+    expected = apply_rules_in_turn(BeautifulSoup(html, 'html.parser'), site_json)
+    result = utils.apply_site_rules(BeautifulSoup(html, 'html.parser'), site_json)
+    assert str(result) == str(expected)
+
+
+def test_rename_away_from_later_rule():
+    site_json = {
+        "rename": [{"tag": "div", "attrs": {"class": "x"}, "name": "p"}],
+        "decompose": [{"tag": "div"}]
+    }
+    assert not utils.get_soup_program(site_json)['single_pass']
+    check_site_rules(site_json, '<div class="x">keep me</div><div>drop</div>')
+
+
+def test_selector_after_structural_change():
+    site_json = {
+        "decompose": [{"tag": "h2"}],
+        "unwrap": [{"selector": "div + p"}]
+    }
+    assert not utils.get_soup_program(site_json)['single_pass']
+    check_site_rules(site_json, '<article><div>a</div><h2>t</h2><p>b</p></article>')
+
+
+def test_independent_rules_single_pass():
+    site_json = {
+        "decompose": [{"tag": "aside"}],
+        "unwrap": [{"tag": "span", "attrs": {"class": "wrap"}}]
+    }
+    assert utils.get_soup_program(site_json)['single_pass']
+    check_site_rules(site_json, '<p><span class="wrap">a</span><aside>b</aside></p>')
@@ -1,82 +1,230 @@
 from __future__ import unicode_literals
-import asyncio, base64, basencode, certifi, cloudscraper, html, importlib, io, json, math, os, pytz, random, re, secrets, string, time, tldextract
-import curl_cffi, requests
-import pygal, pygal.style
-from browserforge.headers import HeaderGenerator
-from bs4 import BeautifulSoup, NavigableString
+import asyncio, atexit, base64, basencode, certifi, cloudscraper, concurrent.futures, contextlib, contextvars, copy, functools, html, importlib, io, json, math, os, pytz, random, re, secrets, soupsieve, string, sys, threading, time, tldextract
+import curl_cffi, lxml.etree, lxml.html, requests
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer, Tag
 from datetime import datetime, timedelta
-from duckduckgo_search import DDGS
+from email.utils import parsedate_to_datetime
 from markdown2 import markdown
 from PIL import ImageFile
-from playwright.async_api import async_playwright
 from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
-from urllib.parse import parse_qs, quote, quote_plus, urlsplit
+from urllib.parse import parse_qs, quote, quote_plus, urljoin, urlsplit
 
-import config, image_utils
-from feedhandlers import vimeo, youtube
+import cache_utils, config, image_utils
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+# Process-wide site registry. sites.json is only parsed when the file changes (by mtime) and the
+# 'same' and 'family' indirections are resolved up front into flat entries, so a lookup is just a
+# dict hit on the domain (and netloc for domains with multiple sites).
+_sites_registry = {
+  "filename": './sites.json',
+  "mtime": None,
+  "sites_json": {},
+  "domains": {},
+  "router": {}
+}
+_sites_registry_lock = threading.Lock()
+
+def select_site_entry(site_entry, netloc):
+  # Entries are either a dict for the whole domain, or a list of dicts keyed by netloc (with an optional 'default')
+  if isinstance(site_entry, dict):
+    return site_entry
+  site_json = None
+  if isinstance(site_entry, list):
+    for it in site_entry:
+      if netloc in it:
+        site_json = it[netloc]
+      elif 'default' in it:
+        site_json = it['default']
+  return site_json
+
+def resolve_site_entry(sites_json, site_json):
+  if site_json and 'same' in site_json and site_json['same']['domain'] in sites_json:
+    same_json = select_site_entry(sites_json[site_json['same']['domain']], site_json['same']['netloc'])
+    if same_json:
+      site_json = same_json
+  if site_json and 'family' in site_json and site_json['family'] in sites_json.get('_families', {}):
+    # site values will overwrite family values at the top level
+    family_json = copy.deepcopy(sites_json['_families'][site_json['family']])
+    family_json.update(site_json)
+    site_json = family_json
+  return site_json
+
+def compile_sites_registry(sites_json):
+  domains = {}
+  for domain, site_entry in sites_json.items():
+    if domain == '_families':
+      continue
+    if isinstance(site_entry, dict):
+      domains[domain] = {
+        "site": resolve_site_entry(sites_json, site_entry)
+      }
+    elif isinstance(site_entry, list):
+      netlocs = {}
+      default_site = None
+      for it in site_entry:
+        for key, val in it.items():
+          if key == 'default':
+            default_site = resolve_site_entry(sites_json, val)
+          else:
+            netlocs[key] = resolve_site_entry(sites_json, val)
+      domains[domain] = {
+        "netlocs": netlocs,
+        "default": default_site
+      }
+  return domains
+
+def load_sites_registry(force=False):
+  filename = _sites_registry['filename']
+  try:
+    mtime = os.stat(filename).st_mtime_ns
+  except OSError as e:
+    logger.warning('unable to stat {}: {}'.format(filename, e.__class__.__name__))
+    return _sites_registry
+  if not force and mtime == _sites_registry['mtime']:
+    return _sites_registry
+  with _sites_registry_lock:
+    if force or mtime != _sites_registry['mtime']:
+      sites_json = read_json_file(filename)
+      if sites_json:
+        _sites_registry['sites_json'] = sites_json
+        _sites_registry['domains'] = compile_sites_registry(sites_json)
+        _sites_registry['router'] = compile_site_router(sites_json, _sites_registry['domains'])
+        route_site_domain.cache_clear()
+        get_site_domain.cache_clear()
+        _sites_registry['mtime'] = mtime
+        logger.debug('loaded {} sites from {}'.format(len(_sites_registry['domains']), filename))
+  return _sites_registry
+
+def get_sites_json():
+  # The parsed sites.json - treat as read-only
+  return load_sites_registry()['sites_json']
+
+def get_site_key(domain, netloc=''):
+  # The (domain, netloc) key of the registry entry that serves this site, or None if it's not in sites.json
+  entry = load_sites_registry()['domains'].get(domain)
+  if not entry:
+    return None
+  if 'site' in entry:
+    return (domain, '')
+  if netloc in entry['netlocs']:
+    return (domain, netloc)
+  if entry['default']:
+    return (domain, 'default')
+  return None
+
+def lookup_static_site(site_key):
+  entry = load_sites_registry()['domains'][site_key[0]]
+  if 'site' in entry:
+    return entry['site']
+  if site_key[1] == 'default':
+    return entry['default']
+  return entry['netlocs'][site_key[1]]
+
+def lookup_site(domain, netloc=''):
+  site_key = get_site_key(domain, netloc)
+  if not site_key:
+    return None
+  site_json = lookup_static_site(site_key)
+  if not site_json:
+    return None
+  # Handlers are free to modify their site_json, so hand out a copy
+  site_json = copy.deepcopy(site_json)
+  site_state = get_site_state(site_key)
+  if site_state:
+    # The runtime values are shared too (cookies, tokens...)
+    site_json.update(copy.deepcopy(site_state))
+  return site_json
+
+# Url routing: the sites.json domain key for a host. Computing it needs the Public Suffix List (tldextract),
+# so the registered domains of the hosts found in sites.json (netloc keys and feed/api urls) are compiled into
+# a trie of reversed hostname labels when sites.json is loaded. A host matches the deepest registered domain
+# it ends with, which covers the domain itself and all its subdomains. Hosts not in the trie fall back to
+# tldextract. Results are memoized per host and per url.
+site_router_memo_size = 4096
+
+def extract_site_domain(scheme, host):
+  if scheme == 'at':
+    return 'bsky'
+  tld = tldextract.extract(host)
+  if tld.domain == 'youtu' and tld.suffix == 'be':
+    domain = 'youtu.be'
+  elif tld.domain == 'megaphone' and tld.suffix == 'fm':
+    domain = 'megaphone.fm'
+  elif tld.domain == 'go':
+    domain = tld.subdomain
+  # elif tld.domain == 'feedburner':
+  #   domain = urlsplit(url).path.split('/')[1].lower()
+  else:
+    domain = tld.domain
+  return domain
+
+def compile_site_router(sites_json, domains):
+  hosts = {}
+  for domain, site_entry in sites_json.items():
+    if domain not in domains:
+      continue
+    for it in (site_entry if isinstance(site_entry, list) else [{"": site_entry}]):
+      for netloc, site_json in it.items():
+        if netloc and netloc != 'default':
+          hosts[netloc] = domain
+        if isinstance(site_json, dict):
+          for val in site_json.values():
+            for url in (val if isinstance(val, list) else [val]):
+              if isinstance(url, str) and url.startswith('http'):
+                hosts.setdefault(urlsplit(url).hostname or '', domain)
+  trie = {}
+  for host, domain in hosts.items():
+    tld = tldextract.extract(host)
+    # Only route the registered domain (and so all its subdomains) if tldextract would give the same domain key,
+    # the 'go' special case depends on the subdomain so those hosts are left to tldextract
+    if not tld.top_domain_under_public_suffix or tld.domain == 'go' or extract_site_domain('https', tld.top_domain_under_public_suffix) != domain:
+      continue
+    node = trie
+    for label in reversed(tld.top_domain_under_public_suffix.split('.')):
+      node = node.setdefault(label, {})
+    node[''] = domain
+  return trie
+
+@functools.lru_cache(maxsize=site_router_memo_size)
+def route_site_domain(scheme, host):
+  if scheme != 'at':
+    node = _sites_registry['router']
+    domain = None
+    for label in reversed(host.split('.')):
+      node = node.get(label)
+      if node is None:
+        break
+      domain = node.get('', domain)
+    if domain:
+      return domain
+  return extract_site_domain(scheme, host)
+
+@functools.lru_cache(maxsize=site_router_memo_size)
+def get_site_domain(url):
+  # Returns the sites.json domain key and the netloc for the url
+  split_url = urlsplit(url.strip())
+  if split_url.hostname:
+    host = split_url.hostname
+  else:
+    host = url.strip()
+  return route_site_domain(split_url.scheme, host), split_url.netloc
+
 def get_site_json(url, domain=''):
+  netloc = ''
   if not domain:
-    split_url = urlsplit(url)
-    netloc = split_url.netloc
-    tld = tldextract.extract(url.strip())
-    if split_url.scheme == 'at':
-      domain = 'bsky'
-    elif tld.domain == 'youtu' and tld.suffix == 'be':
-      domain = 'youtu.be'
-    elif tld.domain == 'megaphone' and tld.suffix == 'fm':
-      domain = 'megaphone.fm'
-    elif tld.domain == 'go':
-      domain = tld.subdomain
-    # elif tld.domain == 'feedburner':
-    #   domain = urlsplit(url).path.split('/')[1].lower()
-    else:
-      domain = tld.domain
+    domain, netloc = get_site_domain(url)
 
-  site_json = None
-  sites_json = read_json_file('./sites.json')
-  if domain in sites_json:
-    if isinstance(sites_json[domain], dict):
-      site_json = sites_json[domain]
-    elif isinstance(sites_json[domain], list):
-      for it in sites_json[domain]:
-        default_site = None
-        if netloc in it:
-          site_json = it[netloc]
-        elif 'default' in it:
-          site_json = it['default']
-        if not site_json and default_site:
-          site_json = default_site
-
-  if site_json and 'same' in site_json:
-    domain = site_json['same']['domain']
-    netloc = site_json['same']['netloc']
-    if isinstance(sites_json[domain], dict):
-      site_json = sites_json[domain]
-    elif isinstance(sites_json[domain], list):
-      for it in sites_json[domain]:
-        default_site = None
-        if netloc in it:
-          site_json = it[netloc]
-        elif 'default' in it:
-          site_json = it['default']
-        if not site_json and default_site:
-          site_json = default_site
-
-  if site_json and 'family' in site_json and site_json['family'] in sites_json['_families']:
-    # site values will overwrite family values at the top level
-    site_copy = site_json.copy()
-    site_json = sites_json['_families'][site_json['family']]
-    site_json.update(site_copy)
-    # print(site_json)
+  site_json = lookup_site(domain, netloc)
 
   # if not site_json:
   if False:
+    split_url = urlsplit(url)
+    tld = tldextract.extract(url.strip())
+    sites_json = read_json_file('./sites.json')
     if url_exists('{}://{}/wp-json/wp/v2/posts'.format(split_url.scheme, split_url.netloc)):
       site_json = {
           "module": "wp_posts",
@@ -137,21 +285,180 @@ def get_site_json(url, domain=''):
             write_file(sites_json, './sites.json')
   return site_json
 
+# Runtime state that handlers learn while running (Next.js buildIds, cookies, tokens, etc.) is kept
+# separate from the static sites.json config. Updates are made in memory and written out in batches
+# by a background timer; the state is overlaid on top of the site config by lookup_site. Each site's
+# state also records the sites.json value every key had when it was written, and a runtime value is
+# dropped once its sites.json value is edited, so manual edits to sites.json still take effect.
+_site_state = {
+  "filename": './sites_state.json',
+  "flush_interval": 5,
+  "loaded": False,
+  "sites": {},
+  "dirty": False,
+  "timer": None
+}
+_site_state_lock = threading.Lock()
+
+def site_state_key(site_key):
+  if site_key[1]:
+    return '{}|{}'.format(site_key[0], site_key[1])
+  return site_key[0]
+
+def load_site_state():
+  with _site_state_lock:
+    if _site_state['loaded']:
+      return
+    if os.path.isfile(_site_state['filename']) and os.stat(_site_state['filename']).st_size > 0:
+      try:
+        with open(_site_state['filename'], 'r', encoding='utf-8') as f:
+          _site_state['sites'] = json.load(f)
+      except Exception as e:
+        logger.warning('error {} loading {}'.format(e.__class__.__name__, _site_state['filename']))
+    _site_state['loaded'] = True
+
+def get_site_state(site_key):
+  # The runtime values for a site, leaving out any whose sites.json value has changed since
+  if not _site_state['loaded']:
+    load_site_state()
+  state = _site_state['sites'].get(site_state_key(site_key))
+  if not state or not isinstance(state.get('values'), dict):
+    return None
+  static_json = lookup_static_site(site_key) or {}
+  base = state.get('base', {})
+  return {key: val for key, val in state['values'].items() if static_json.get(key) == base.get(key)}
+
+def flush_site_state():
+  with _site_state_lock:
+    _site_state['timer'] = None
+    if not _site_state['dirty']:
+      return
+    data = json.dumps(_site_state['sites'], indent=4, sort_keys=True)
+    _site_state['dirty'] = False
+  # Write to a temp file and swap it in so a crash can't leave a partial file
+  tmp_filename = _site_state['filename'] + '.tmp'
+  try:
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+      f.write(data)
+    os.replace(tmp_filename, _site_state['filename'])
+  except Exception as e:
+    logger.warning('error {} writing {}'.format(e.__class__.__name__, _site_state['filename']))
+    with _site_state_lock:
+      _site_state['dirty'] = True
+
+atexit.register(flush_site_state)
+
+def update_site_state(site_key, values):
+  if not _site_state['loaded']:
+    load_site_state()
+  key = site_state_key(site_key)
+  static_json = lookup_static_site(site_key) or {}
+  state = {
+    "values": values,
+    "base": {it: static_json.get(it) for it in values}
+  }
+  with _site_state_lock:
+    if _site_state['sites'].get(key) == state:
+      return
+    _site_state['sites'][key] = state
+    _site_state['dirty'] = True
+    if not _site_state['timer']:
+      _site_state['timer'] = threading.Timer(_site_state['flush_interval'], flush_site_state)
+      _site_state['timer'].daemon = True
+      _site_state['timer'].start()
+
 def update_sites(url, site_json):
-  tld = tldextract.extract(url)
-  sites_json = read_json_file('./sites.json')
-  if tld.domain not in sites_json:
-    logger.warning('site' + tld.domain + ' is not in sites.json')
+  domain, netloc = get_site_domain(url)
+  site_key = get_site_key(domain, netloc)
+  if not site_key:
+    logger.warning('site ' + netloc + ' is not in sites.json')
     return None
-  if isinstance(sites_json[tld.domain], dict):
-    sites_json[tld.domain] = site_json
-  elif isinstance(sites_json[tld.domain], list):
-    netloc = urlsplit(url).netloc
-    if netloc not in sites_json[tld.domain][0]:
-      logger.warning('site' + netloc + ' is not in sites.json')
-      return None
-    sites_json[tld.domain][0][netloc] = site_json
-  write_file(sites_json, './sites.json')
+  # Only keep the values that differ from the static config
+  static_json = lookup_static_site(site_key)
+  values = {key: val for key, val in site_json.items() if static_json.get(key) != val}
+  update_site_state(site_key, values)
+
+def update_site_values(domain, values, netloc=''):
+  # Set individual runtime values for a site, e.g. update_site_values('apple', {"token": token})
+  site_key = get_site_key(domain, netloc)
+  if not site_key:
+    logger.warning('site ' + domain + ' is not in sites.json')
+    return None
+  site_values = get_site_state(site_key)
+  if site_values:
+    site_values = site_values.copy()
+    site_values.update(values)
+  else:
+    site_values = values.copy()
+  update_site_state(site_key, site_values)
+
+# Feed handler modules are imported on first use (heavy optional dependencies are imported inside the
+# functions that need them). The index of available handlers is read from the feedhandlers directory so
+# module names from sites.json that don't exist don't cost an import attempt. The most used modules in
+# sites.json can be imported at startup in the background (config.handler_prewarm_count) and the import times
+# are logged so that slow imports show up.
+_handlers = {
+  "index": None,
+  "modules": {},
+  "import_times": {}
+}
+
+def get_handler_index():
+  if _handlers['index'] is None:
+    handlers_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feedhandlers')
+    _handlers['index'] = set(os.path.splitext(it)[0] for it in os.listdir(handlers_dir) if it.endswith('.py') and it != '__init__.py')
+  return _handlers['index']
+
+def get_handler(module_name):
+  # Returns the feedhandlers module, importing it if needed. Raises ImportError for unknown modules.
+  module = _handlers['modules'].get(module_name)
+  if module:
+    return module
+  if module_name not in get_handler_index():
+    raise ImportError('unknown handler module ' + module_name)
+  start = time.perf_counter()
+  module = importlib.import_module('.' + module_name, 'feedhandlers')
+  if module_name not in _handlers['import_times']:
+    _handlers['import_times'][module_name] = time.perf_counter() - start
+    logger.debug('imported handler {} in {:.3f}s'.format(module_name, _handlers['import_times'][module_name]))
+  _handlers['modules'][module_name] = module
+  return module
+
+def get_handler_import_times():
+  return dict(sorted(_handlers['import_times'].items(), key=lambda it: it[1], reverse=True))
+
+def get_top_handlers(count):
+  # The most used modules in sites.json
+  module_counts = {}
+  for val in get_sites_json().values():
+    for site_json in (val if isinstance(val, list) else [val]):
+      if isinstance(site_json, dict):
+        for it in site_json.values() if 'module' not in site_json else [site_json]:
+          if isinstance(it, dict) and it.get('module'):
+            module_counts[it['module']] = module_counts.get(it['module'], 0) + 1
+  modules = sorted(module_counts, key=lambda it: module_counts[it], reverse=True)
+  return [it for it in modules if it in get_handler_index()][:count]
+
+def prewarm_handlers(count=None):
+  # Imports the top count handlers (default config.handler_prewarm_count) in a background thread and logs the import times
+  if count is None:
+    count = getattr(config, 'handler_prewarm_count', 0)
+  if count <= 0:
+    return None
+  def prewarm():
+    start = time.perf_counter()
+    module_names = get_top_handlers(count)
+    for module_name in module_names:
+      try:
+        get_handler(module_name)
+      except Exception as e:
+        logger.warning('error {} importing handler {}'.format(e.__class__.__name__, module_name))
+    import_times = get_handler_import_times()
+    slowest = ', '.join('{} {:.3f}s'.format(key, val) for key, val in list(import_times.items())[:10])
+    logger.info('prewarmed {} handlers in {:.3f}s, slowest: {}'.format(len(module_names), time.perf_counter() - start, slowest))
+  thread = threading.Thread(target=prewarm, name='prewarm', daemon=True)
+  thread.start()
+  return thread
 
 def get_module(url, handler=''):
   site_json = {}
@@ -168,7 +475,7 @@ def get_module(url, handler=''):
     module_name = '.{}'.format(handler)
   if module_name:
     try:
-      module = importlib.import_module(module_name, 'feedhandlers')
+      module = get_handler(module_name[1:])
     except:
       logger.warning('unable to load module ' + module_name)
       module = None
@@ -179,9 +486,8 @@ def get_module(url, handler=''):
 # https://www.peterbe.com/plog/best-practice-with-retries-with-requests
 # https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/#retry-on-failure
 # https://stackoverflow.com/questions/15431044/can-i-set-max-retries-for-requests-request
-def requests_retry_session(retries=4):
-  session = requests.Session()
-  retry = Retry(
+def get_retry(retries=4):
+  return Retry(
     total=retries,
     read=retries,
     connect=retries,
@@ -189,35 +495,205 @@ def requests_retry_session(retries=4):
     status_forcelist=[404, 429, 502, 503, 504],
     allowed_methods={"HEAD", "GET", "OPTIONS"}
   )
-  adapter = HTTPAdapter(max_retries=retry)
+
+def requests_retry_session(retries=4):
+  session = requests.Session()
+  adapter = HTTPAdapter(max_retries=get_retry(retries))
   session.mount('http://', adapter)
   session.mount('https://', adapter)
   return session
 
+# Pooled HTTP sessions so connections (and TLS sessions) are kept alive and reused between calls.
+# The requests adapters own the urllib3 connection pools and are shared by all threads. requests and
+# cloudscraper sessions are kept per thread. curl_cffi sessions are not thread safe either, but the dev
+# server runs every request on a new thread, so they are kept in a shared pool instead: callers borrow
+# one with get_http_session and hand it back with release_http_session. Cookies are cleared between
+# calls so that each call still starts clean, except for cloudscraper which needs to keep its challenge
+# cookies.
+http_pool_connections = 100 # number of hosts to keep connection pools for
+http_pool_maxsize = 10 # max idle connections per host kept for reuse
+http_curl_pool_size = 8 # max idle curl_cffi sessions kept per proxy/verify setting
+# Concurrent requests to a host are capped at http_host_limit. Waiting for a slot is bounded by
+# http_host_wait seconds, after which the request goes ahead anyway, so long streams can't stall a host.
+http_host_limit = 10
+http_host_wait = 10
+_http_adapters = {}
+_http_sessions = threading.local()
+_http_curl_sessions = {}
+_http_host_slots = {}
+_http_lock = threading.Lock()
+_http_stats = {}
+
+def get_http_adapter(retries):
+  adapter = _http_adapters.get(retries)
+  if not adapter:
+    with _http_lock:
+      adapter = _http_adapters.get(retries)
+      if not adapter:
+        # pool_maxsize connections per host are kept for reuse. The pool doesn't block: requests beyond that open
+        # an extra connection (discarded afterwards) rather than waiting, possibly forever, behind long streams.
+        # With retries=0 there is no Retry at all, so error statuses (404, 5xx...) are returned as-is instead of
+        # raising RetryError
+        if retries:
+          max_retries = get_retry(retries)
+        else:
+          max_retries = Retry(0, read=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=http_pool_connections, pool_maxsize=http_pool_maxsize, pool_block=False, max_retries=max_retries)
+        _http_adapters[retries] = adapter
+  return adapter
+
+def get_http_session(backend='requests', use_proxy=False, verify=False, retries=3):
+  if backend == 'curl_cffi':
+    key = (use_proxy, verify)
+    with _http_lock:
+      sessions = _http_curl_sessions.get(key)
+      session = sessions.pop() if sessions else None
+  else:
+    if not hasattr(_http_sessions, 'sessions'):
+      _http_sessions.sessions = {}
+    key = (backend, use_proxy, verify, retries)
+    session = _http_sessions.sessions.get(key)
+  if session:
+    if backend != 'cloudscraper':
+      session.cookies.clear()
+    update_http_stats(backend, 'reused')
+    return session
+
+  if use_proxy:
+    proxies = config.proxies
+  else:
+    proxies = {}
+  if backend == 'curl_cffi':
+    session = curl_cffi.Session(impersonate=config.impersonate, proxies=proxies, verify=verify)
+  elif backend == 'cloudscraper':
+    session = cloudscraper.create_scraper()
+    if proxies:
+      session.proxies = proxies
+  else:
+    session = requests.Session()
+    adapter = get_http_adapter(retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.proxies = proxies
+    session.verify = verify
+  if backend != 'curl_cffi':
+    _http_sessions.sessions[key] = session
+  update_http_stats(backend, 'created')
+  return session
+
+def release_http_session(backend, session, use_proxy=False, verify=False):
+  # Returns a borrowed curl_cffi session to the pool. Other backends are kept per thread and need no release.
+  if backend != 'curl_cffi':
+    return
+  with _http_lock:
+    sessions = _http_curl_sessions.setdefault((use_proxy, verify), [])
+    if len(sessions) < http_curl_pool_size:
+      sessions.append(session)
+      return
+  session.close()
+
+@contextlib.contextmanager
+def http_host_slot(url):
+  host = urlsplit(url).netloc
+  with _http_lock:
+    slot = _http_host_slots.get(host)
+    if not slot:
+      slot = threading.BoundedSemaphore(http_host_limit)
+      _http_host_slots[host] = slot
+  acquired = slot.acquire(timeout=http_host_wait)
+  if not acquired:
+    logger.debug('no free connection slot for {} after {}s'.format(host, http_host_wait))
+  try:
+    yield
+  finally:
+    if acquired:
+      slot.release()
+
+def update_http_stats(backend, key, val=1):
+  with _http_lock:
+    if backend not in _http_stats:
+      _http_stats[backend] = {"created": 0, "reused": 0, "requests": 0, "elapsed": 0.0}
+    _http_stats[backend][key] += val
+
+def get_http_stats():
+  # Session reuse counts and average request time per backend
+  stats = {}
+  with _http_lock:
+    for backend, val in _http_stats.items():
+      stats[backend] = val.copy()
+      if val['requests']:
+        stats[backend]['avg_elapsed'] = val['elapsed'] / val['requests']
+  return stats
+
+def http_get(backend, url, use_proxy=False, verify=False, retries=3, **kwargs):
+  start = time.perf_counter()
+  session = get_http_session(backend, use_proxy, verify, retries)
+  try:
+    with http_host_slot(url):
+      return session.get(url, **kwargs)
+  finally:
+    release_http_session(backend, session, use_proxy, verify)
+    update_http_stats(backend, 'requests')
+    update_http_stats(backend, 'elapsed', time.perf_counter() - start)
+
+# browserforge header generation is slow enough to matter on every request, so a pool of header sets
+# is generated per profile and requests pick from it. Pools are regenerated in a background thread
+# once they are older than header_pool_refresh seconds. A failed refresh keeps the old pool and is retried
+# after header_pool_retry seconds.
+header_profiles = {
+  "desktop": {"browser": "chrome", "os": "windows", "device": "desktop", "locale": "en-US", "http_version": 2},
+  "mobile": {"browser": "safari", "os": "ios", "device": "mobile", "locale": "en-US", "http_version": 2}
+}
+header_pool_size = 20
+header_pool_refresh = 3600
+header_pool_retry = 300
+_header_pools = {}
+_header_pools_lock = threading.Lock()
+
+def generate_header_pool(profile):
+  from browserforge.headers import HeaderGenerator
+  header_gen = HeaderGenerator(**header_profiles[profile])
+  _header_pools[profile] = {
+    "headers": [header_gen.generate() for i in range(header_pool_size)],
+    "timestamp": time.time(),
+    "refreshing": False
+  }
+
+def refresh_header_pool(profile):
+  try:
+    generate_header_pool(profile)
+    logger.debug('refreshed {} header pool'.format(profile))
+  except Exception as e:
+    logger.warning('error {} refreshing {} header pool'.format(e.__class__.__name__, profile))
+    pool = _header_pools[profile]
+    pool['timestamp'] = time.time() - header_pool_refresh + header_pool_retry
+    pool['refreshing'] = False
+
+def get_pool_headers(profile):
+  pool = _header_pools.get(profile)
+  if not pool:
+    with _header_pools_lock:
+      if profile not in _header_pools:
+        generate_header_pool(profile)
+    pool = _header_pools[profile]
+  elif not pool['refreshing'] and time.time() - pool['timestamp'] > header_pool_refresh:
+    with _header_pools_lock:
+      if pool['refreshing']:
+        return random.choice(pool['headers'])
+      pool['refreshing'] = True
+    threading.Thread(target=refresh_header_pool, args=(profile,), daemon=True).start()
+  return random.choice(pool['headers'])
+
 def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True, use_proxy=False, use_curl_cffi=False, use_certifi=False, use_cloudscraper=False):
   # https://www.whatismybrowser.com/guides/the-latest-user-agent/
   # https://developers.whatismybrowser.com/
   # https://github.com/monperrus/crawler-user-agents/blob/master/crawler-user-agents.json
   if user_agent == 'desktop':
     # ua = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36'
-    header_gen = HeaderGenerator(
-      browser='chrome',
-      os='windows',
-      device='desktop',
-      locale='en-US',
-      http_version=2
-    )
-    ua = header_gen.generate()['User-Agent']
+    ua = get_pool_headers('desktop')['User-Agent']
   elif user_agent == 'mobile':
     # ua = 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_1_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Mobile/15E148 Safari/604.1'
-    header_gen = HeaderGenerator(
-      browser='safari',
-      os='ios',
-      device='mobile',
-      locale='en-US',
-      http_version=2
-    )
-    ua = header_gen.generate()['User-Agent']
+    ua = get_pool_headers('mobile')['User-Agent']
   elif user_agent == 'googlebot':
     # https://developers.google.com/search/docs/crawling-indexing/overview-google-crawlers
     ua = 'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; Googlebot/2.1; +http://www.google.com/bot.html) Chrome/135.0.0.0 Safari/537.36'
@@ -293,11 +769,6 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
     }
   # print(headers)
 
-  if use_proxy:
-    proxies = config.proxies
-  else:
-    proxies = {}
-
   if use_certifi:
     verify = certifi.where()
     # verify = config.verify_path
@@ -307,12 +778,11 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
   r = None
   try:
     if use_curl_cffi:
-      r = curl_cffi.get(url, impersonate=config.impersonate, proxies=proxies, verify=verify)
+      r = http_get('curl_cffi', url, use_proxy, verify)
     elif use_cloudscraper:
-      scraper = cloudscraper.create_scraper()
-      r = scraper.get(url)
+      r = http_get('cloudscraper', url)
     else:
-      r = requests_retry_session(retries).get(url, headers=headers, timeout=10, allow_redirects=allow_redirects, proxies=proxies, verify=verify)
+      r = http_get('requests', url, use_proxy, verify, retries, headers=headers, timeout=10, allow_redirects=allow_redirects)
     r.raise_for_status()
   except Exception as e:
     if r != None:
@@ -330,7 +800,7 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
       logger.warning('request error {}{} getting {}'.format(e.__class__.__name__, status_code, url))
       if e.__class__.__name__ == 'SSLError':
         try:
-          r = requests_retry_session(retries).get(url, headers=headers, timeout=10, allow_redirects=allow_redirects, proxies=proxies, verify=verify)
+          r = http_get('requests', url, use_proxy, verify, retries, headers=headers, timeout=10, allow_redirects=allow_redirects)
           r.raise_for_status()
         except Exception as e:
           if r != None:
@@ -344,7 +814,7 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
     if r != None and (r.status_code == 401 or r.status_code == 403):
       logger.debug('trying curl_cffi')
       try:
-        r = curl_cffi.get(url, impersonate=config.impersonate, proxies=config.proxies, verify=verify)
+        r = http_get('curl_cffi', url, True, verify)
         # r = curl_cffi.get(url, impersonate="chrome116", headers=headers, timeout=10, allow_redirects=allow_redirects, proxies=config.proxies)
         r.raise_for_status()
       except Exception as e:
@@ -358,10 +828,9 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
         logger.warning('curl_cffi error {}{} getting {}'.format(e.__class__.__name__, status_code, url))
     if r != None and (r.status_code == 401 or r.status_code == 403):
       logger.debug('trying cloudscraper')
-      scraper = cloudscraper.create_scraper()
       #scraper = cloudscraper.create_scraper(browser={"browser": "chrome", "platform": "android", "desktop": False}, delay=10)
       try:
-        r = scraper.get(url)
+        r = http_get('cloudscraper', url)
         r.raise_for_status()
       except Exception as e:
         if r != None:
@@ -376,34 +845,166 @@ def get_request(url, user_agent, headers=None, retries=3, allow_redirects=True,
     #r = None
   return r
 
-async def async_get_browser_content(url, browser_name, headless, args):
-  async with async_playwright() as playwright:
-    # Device emulation: https://playwright.dev/python/docs/emulation
-    # https://github.com/microsoft/playwright/blob/main/packages/playwright-core/src/server/deviceDescriptorsSource.json
-    if browser_name == 'chromium' or browser_name == 'chrome':
-      engine = playwright.chromium
-      device = playwright.devices['Desktop Chrome']
-    elif browser_name == 'webkit' or browser_name == 'safari':
-      engine = playwright.webkit
-      device = playwright.devices['Desktop Safari']
+# Persistent headless browser pool. Playwright runs on its own event loop in a background thread and
+# the browsers stay running between calls. Browser contexts are reused (with their cookies cleared) for
+# up to browser_context_max_uses pages and closed after browser_context_idle_timeout seconds of idle time.
+# The number of open pages is limited to browser_max_pages, and a browser that crashes or disconnects is
+# dropped and relaunched on the next call.
+browser_max_pages = 4
+browser_context_idle_timeout = 60
+browser_context_max_uses = 20
+browser_timeout = 90
+_browser_pool = {
+  "loop": None,
+  "playwright": None,
+  "semaphore": None,
+  "browsers": {},
+  "contexts": {}
+}
+_browser_pool_lock = threading.Lock()
+
+def get_browser_loop():
+  if not _browser_pool['loop']:
+    with _browser_pool_lock:
+      if not _browser_pool['loop']:
+        # The default event loop type works on each platform (Proactor on Windows for subprocesses)
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name='browser', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(close_idle_browser_contexts(), loop)
+        _browser_pool['loop'] = loop
+  return _browser_pool['loop']
+
+def run_browser_task(coro, timeout=browser_timeout):
+  # Run a coroutine on the browser pool's event loop and wait for the result
+  future = asyncio.run_coroutine_threadsafe(coro, get_browser_loop())
+  try:
+    return future.result(timeout)
+  except concurrent.futures.TimeoutError:
+    future.cancel()
+    raise
+
+async def get_pool_playwright():
+  if not _browser_pool['playwright']:
+    from playwright.async_api import async_playwright
+    _browser_pool['playwright'] = await async_playwright().start()
+  return _browser_pool['playwright']
+
+async def get_pool_browser(browser_name, headless):
+  playwright = await get_pool_playwright()
+  key = (browser_name, headless)
+  browser = _browser_pool['browsers'].get(key)
+  if browser and not browser.is_connected():
+    logger.warning('{} browser disconnected'.format(browser_name))
+    drop_pool_browser(key)
+    browser = None
+  if not browser:
+    if browser_name == 'webkit' or browser_name == 'safari':
+      browser = await playwright.webkit.launch(headless=headless)
     elif browser_name == 'firefox':
-      engine = playwright.firefox
-      device = playwright.devices['Desktop Firefox']
+      browser = await playwright.firefox.launch(headless=headless)
     elif browser_name == 'edge':
-      engine = playwright.chromium
-      device = playwright.devices['Desktop Edge']
+      browser = await playwright.chromium.launch(channel="msedge", headless=headless)
     else:
-      engine = playwright.chromium
-      device = playwright.devices['Desktop Chrome']
+      browser = await playwright.chromium.launch(headless=headless)
+    browser.on('disconnected', lambda it: drop_pool_browser(key, it))
+    _browser_pool['browsers'][key] = browser
+    logger.debug('launched {} browser'.format(browser_name))
+  return browser
+
+def drop_pool_browser(key, browser=None):
+  if browser and _browser_pool['browsers'].get(key) != browser:
+    return
+  _browser_pool['browsers'].pop(key, None)
+  for context_key in [it for it in _browser_pool['contexts'].keys() if it[:2] == key]:
+    del _browser_pool['contexts'][context_key]
+
+def get_browser_device_name(browser_name):
+  # Device emulation: https://playwright.dev/python/docs/emulation
+  # https://github.com/microsoft/playwright/blob/main/packages/playwright-core/src/server/deviceDescriptorsSource.json
+  if browser_name == 'webkit' or browser_name == 'safari':
+    return 'Desktop Safari'
+  elif browser_name == 'firefox':
+    return 'Desktop Firefox'
+  elif browser_name == 'edge':
+    return 'Desktop Edge'
+  return 'Desktop Chrome'
+
+async def get_pool_context(browser_name, headless, device_name):
+  browser = await get_pool_browser(browser_name, headless)
+  key = (browser_name, headless, device_name)
+  contexts = _browser_pool['contexts'].setdefault(key, [])
+  while contexts:
+    it = contexts.pop()
+    try:
+      await it['context'].clear_cookies()
+      return it
+    except Exception:
+      pass
+  device = _browser_pool['playwright'].devices[device_name]
+  return {
+    "context": await browser.new_context(**device),
+    "browser": browser,
+    "key": key,
+    "uses": 0,
+    "last_used": time.time()
+  }
 
-    if browser_name == 'edge':
-        browser = await engine.launch(channel="msedge", headless=headless)
-    else:
-        browser = await engine.launch(headless=headless)
+async def release_pool_context(it):
+  it['uses'] += 1
+  it['last_used'] = time.time()
+  if it['uses'] < browser_context_max_uses and _browser_pool['browsers'].get(it['key'][:2]) == it['browser']:
+    _browser_pool['contexts'].setdefault(it['key'], []).append(it)
+  else:
+    try:
+      await it['context'].close()
+    except Exception:
+      pass
 
-    context = await browser.new_context(**device)
-    page = await context.new_page()
+async def close_idle_browser_contexts():
+  while True:
+    await asyncio.sleep(browser_context_idle_timeout / 2)
+    now = time.time()
+    for key, contexts in list(_browser_pool['contexts'].items()):
+      for it in [it for it in contexts if now - it['last_used'] > browser_context_idle_timeout]:
+        contexts.remove(it)
+        try:
+          await it['context'].close()
+        except Exception:
+          pass
+
+@contextlib.asynccontextmanager
+async def browser_page(browser_name=config.default_browser, headless=True, device_name=''):
+  # Usage (on the browser loop, see run_browser_task):
+  #   async with browser_page('chrome') as page:
+  #     await page.goto(url)
+  if not _browser_pool['semaphore']:
+    _browser_pool['semaphore'] = asyncio.Semaphore(browser_max_pages)
+  async with _browser_pool['semaphore']:
+    playwright = await get_pool_playwright()
+    if device_name and device_name in playwright.devices:
+      browser_name = playwright.devices[device_name]['default_browser_type']
+    else:
+      device_name = get_browser_device_name(browser_name)
+    try:
+      context = await get_pool_context(browser_name, headless, device_name)
+      page = await context['context'].new_page()
+    except Exception as e:
+      # Most likely the browser crashed - relaunch it and try once more
+      logger.warning('browser exception {}, relaunching {}'.format(e.__class__.__name__, browser_name))
+      drop_pool_browser((browser_name, headless))
+      context = await get_pool_context(browser_name, headless, device_name)
+      page = await context['context'].new_page()
+    try:
+      yield page
+    finally:
+      try:
+        await page.close()
+      except Exception:
+        pass
+      await release_pool_context(context)
 
+async def async_get_browser_content(url, browser_name, headless, args):
+  async with browser_page(browser_name, headless) as page:
     if 'wait_until' in args:
         await page.goto(url, wait_until=args['wait_until'])
     else:
@@ -417,16 +1018,10 @@ async def async_get_browser_content(url, browser_name, headless, args):
         await page.wait_for_timeout(int(args['waitfortime']))
 
     content = await page.content()
-  
-    await context.close()
-    await browser.close()
   return content
 
 def get_browser_content(url, browser_name=config.default_browser, headless=True, args={}):
-  loop = asyncio.ProactorEventLoop()
-  asyncio.set_event_loop(loop)
-  content = loop.run_until_complete(async_get_browser_content(url, browser_name, headless, args))
-  return content
+  return run_browser_task(async_get_browser_content(url, browser_name, headless, args))
 
 def get_flaresolverr_content(url):
     data = {
@@ -448,6 +1043,187 @@ def get_flaresolverr_content(url):
       logger.warning('flaresolverr requests status code {} for {}'.format(r.status_code, url))
       return None
 
+# HTTP response cache for get_url_json, get_url_html and get_url_content. Responses are kept as long as
+# the origin's Cache-Control/Expires headers allow, or for the site's "cache_ttl" override. Stale responses
+# with an ETag or Last-Modified header are revalidated with a conditional request. Sites can opt out with
+# "no_cache": true. post_url responses are only cached when the site sets "cache_ttl".
+response_cache_max_size = 64 * 1024 * 1024
+response_cache_max_item_size = 4 * 1024 * 1024
+cache_utils.init_cache('responses', max_size=response_cache_max_size)
+
+def get_response_cache_key(method, url, headers=None, data=None, user_agent='', use_proxy=False, use_curl_cffi=False, use_cloudscraper=False):
+  # Sites can answer differently depending on the user-agent profile (desktop, googlebot...) and the backend/proxy
+  # used, so those are part of the key. The profile name is used rather than the random user-agent get_request picks.
+  key = '{} {} {}'.format(method, url, json.dumps([user_agent, use_proxy, use_curl_cffi, use_cloudscraper]))
+  if headers:
+    key_headers = {k.lower(): v for k, v in headers.items()}
+    if key_headers:
+      key += ' ' + json.dumps(key_headers, sort_keys=True)
+  if data:
+    if isinstance(data, (dict, list)):
+      key += ' ' + json.dumps(data, sort_keys=True)
+    else:
+      key += ' ' + str(data)
+  return key
+
+def get_response_cache_ttl(r, site_json=None):
+  # Returns the number of seconds the response is fresh for, or None if it must not be cached
+  if site_json and 'cache_ttl' in site_json:
+    return int(site_json['cache_ttl'])
+  cache_control = r.headers.get('cache-control', '').lower()
+  if 'no-store' in cache_control:
+    return None
+  if 'no-cache' in cache_control:
+    return 0
+  m = re.search(r's-maxage=(\d+)', cache_control)
+  if not m:
+    m = re.search(r'max-age=(\d+)', cache_control)
+  if m:
+    ttl = int(m.group(1))
+    if r.headers.get('age') and r.headers['age'].isnumeric():
+      ttl -= int(r.headers['age'])
+    return max(ttl, 0)
+  if r.headers.get('expires'):
+    try:
+      return max(int(parsedate_to_datetime(r.headers['expires']).timestamp() - time.time()), 0)
+    except:
+      return 0
+  return 0
+
+def cache_response(key, r, site_json=None):
+  if r == None or r.status_code != 200:
+    return
+  ttl = get_response_cache_ttl(r, site_json)
+  if ttl == None:
+    return
+  etag = r.headers.get('etag')
+  last_modified = r.headers.get('last-modified')
+  if ttl == 0 and not etag and not last_modified:
+    # Nothing to revalidate with
+    return
+  size = len(r.content)
+  if size > response_cache_max_item_size:
+    return
+  cache_utils.cache_set('responses', key, r, ttl, size, etag=etag, last_modified=last_modified)
+
+def get_cached_request(url, user_agent, headers=None, retries=3, allow_redirects=True, use_proxy=False, use_curl_cffi=False, use_certifi=False, use_cloudscraper=False, site_json=None):
+  if site_json and site_json.get('no_cache'):
+    return get_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper)
+
+  key = get_response_cache_key('GET', url, headers, None, user_agent, use_proxy, use_curl_cffi, use_cloudscraper)
+  entry = cache_utils.cache_get_entry('responses', key)
+  if entry and entry['expires'] > time.time():
+    cache_utils.cache_count('responses', 'hits')
+    return entry['value']
+  cache_utils.cache_count('responses', 'misses')
+
+  if entry and (entry['etag'] or entry['last_modified']):
+    if headers:
+      headers = headers.copy()
+    else:
+      headers = {}
+    if entry['etag']:
+      headers['if-none-match'] = entry['etag']
+    if entry['last_modified']:
+      headers['if-modified-since'] = entry['last_modified']
+
+  r = get_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper)
+  if entry and r != None and r.status_code == 304:
+    cache_utils.cache_count('responses', 'revalidated')
+    ttl = get_response_cache_ttl(r, site_json)
+    entry['expires'] = time.time() + (ttl if ttl else 0)
+    return entry['value']
+  cache_response(key, r, site_json)
+  return r
+
+def get_response_cache_stats():
+  return cache_utils.cache_stats().get('responses')
+
+# HLS/DASH manifests served through the /proxy/ route are rewritten so that every uri in them also goes
+# through the proxy. Rewritten manifests are cached: VOD for manifest_vod_ttl (or until a signed url expires),
+# live playlists for half the target duration so that players polling them still see new segments.
+manifest_vod_ttl = 6 * 3600
+manifest_live_min_ttl = 1
+cache_utils.init_cache('manifests', max_size=32 * 1024 * 1024)
+
+def get_proxy_url(url, base_url=''):
+  # Resolve url against base_url and route it through the proxy. Non-http uris (data:, skd:) are left alone.
+  if base_url:
+    url = urljoin(base_url, url)
+  if not re.search(r'^https?://', url) or url.startswith(config.server + '/proxy/'):
+    return url
+  return config.server + '/proxy/' + url
+
+def rewrite_hls_manifest(manifest, manifest_url):
+  lines = []
+  for line in manifest.splitlines():
+    line_strip = line.strip()
+    if not line_strip:
+      lines.append(line)
+    elif line_strip.startswith('#'):
+      # EXT-X-KEY, EXT-X-MAP, EXT-X-MEDIA, EXT-X-I-FRAME-STREAM-INF, EXT-X-PART, etc.
+      lines.append(re.sub(r'(URI=")([^"]+)(")', lambda m: m.group(1) + get_proxy_url(m.group(2), manifest_url) + m.group(3), line))
+    else:
+      lines.append(get_proxy_url(line_strip, manifest_url))
+  return '\n'.join(lines) + '\n'
+
+def rewrite_dash_manifest(manifest, manifest_url):
+  # Relative uris are resolved by the player against the (proxied) manifest or parent BaseURL,
+  # so only absolute and root-relative uris need rewriting
+  base_url = manifest_url
+  m = re.search(r'<BaseURL[^>]*>([^<]+)</BaseURL>', manifest)
+  if m:
+    # Root-relative uris are relative to the first BaseURL's host
+    base_url = urljoin(manifest_url, html.unescape(m.group(1).strip()))
+  def rewrite_uri(uri):
+    uri_strip = html.unescape(uri.strip())
+    if re.search(r'^(https?:)?//', uri_strip) or uri_strip.startswith('/'):
+      return html.escape(get_proxy_url(uri_strip, base_url), quote=True)
+    return uri
+  manifest = re.sub(r'(<BaseURL[^>]*>)([^<]+)(</BaseURL>)', lambda m: m.group(1) + rewrite_uri(m.group(2)) + m.group(3), manifest)
+  manifest = re.sub(r'(\s(?:media|initialization|sourceURL|index|xlink:href)=")([^"]+)(")', lambda m: m.group(1) + rewrite_uri(m.group(2)) + m.group(3), manifest)
+  return manifest
+
+def get_manifest_ttl(manifest, manifest_url):
+  if manifest.lstrip().startswith('#EXTM3U'):
+    if '#EXT-X-ENDLIST' in manifest or '#EXT-X-PLAYLIST-TYPE:VOD' in manifest or '#EXT-X-TARGETDURATION' not in manifest:
+      # VOD or master playlist
+      ttl = manifest_vod_ttl
+    else:
+      m = re.search(r'#EXT-X-TARGETDURATION:\s*(\d+)', manifest)
+      ttl = max(int(m.group(1)) / 2, manifest_live_min_ttl)
+  elif re.search(r'<MPD[^>]+type="dynamic"', manifest):
+    m = re.search(r'minimumUpdatePeriod="PT(?:(\d+)M)?([\d\.]+)S"', manifest)
+    if m:
+      ttl = max(int(m.group(1) or 0) * 60 + float(m.group(2)), manifest_live_min_ttl)
+    else:
+      ttl = manifest_live_min_ttl
+  else:
+    ttl = manifest_vod_ttl
+  # Signed urls (e.g. googlevideo) stop working when they expire
+  m = re.search(r'[/?&]expire[/=](\d+)', manifest_url)
+  if m:
+    ttl = min(ttl, int(m.group(1)) - time.time())
+  return ttl
+
+def get_proxy_manifest(manifest_url, func_get_manifest):
+  # func_get_manifest(manifest_url) returns the upstream response. Returns (manifest, status_code).
+  manifest = cache_utils.cache_get('manifests', manifest_url)
+  if manifest:
+    return manifest, 200
+  r = func_get_manifest(manifest_url)
+  if r.status_code != 200:
+    logger.warning('requests error {} getting {}'.format(r.status_code, manifest_url))
+    return r.text, r.status_code
+  if '.mpd' in manifest_url or '<MPD' in r.text[:1000]:
+    manifest = rewrite_dash_manifest(r.text, r.url)
+  else:
+    manifest = rewrite_hls_manifest(r.text, r.url)
+  ttl = get_manifest_ttl(r.text, manifest_url)
+  if ttl > 0:
+    cache_utils.cache_set('manifests', manifest_url, manifest, ttl, size=len(manifest))
+  return manifest, 200
+
 def get_url_json(url, user_agent='desktop', headers=None, retries=3, allow_redirects=True, use_proxy=False, use_curl_cffi=False, use_certifi=True, use_browser=False, use_cloudscraper=False, site_json=None):
   if use_browser or (site_json and 'use_browser' in site_json and site_json['use_browser'] == True):
     content = get_browser_content(url)
@@ -480,7 +1256,7 @@ def get_url_json(url, user_agent='desktop', headers=None, retries=3, allow_redir
       use_certifi = site_json['use_certifi']
     if 'use_cloudscraper' in site_json:
       use_cloudscraper = site_json['use_cloudscraper']
-  r = get_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper)
+  r = get_cached_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper, site_json)
   if r != None and (r.status_code == 200 or r.status_code == 402 or r.status_code == 404 or r.status_code == 500):
     try:
       return r.json()
@@ -506,7 +1282,7 @@ def get_url_html(url, user_agent='desktop', headers=None, retries=3, allow_redir
       use_certifi = site_json['use_certifi']
     if 'use_cloudscraper' in site_json:
       use_cloudscraper = site_json['use_cloudscraper']
-  r = get_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper)
+  r = get_cached_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_certifi, use_cloudscraper, site_json)
   if r != None and (r.status_code == 200 or r.status_code == 402):
     return r.text
   return None
@@ -515,11 +1291,255 @@ def get_url_content(url, user_agent='googlebot', headers=None, retries=3, allow_
   if use_browser or (site_json and site_json.get('use_browser')):
     return get_browser_content(url)
 
-  r = get_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_cloudscraper)
+  r = get_cached_request(url, user_agent, headers, retries, allow_redirects, use_proxy, use_curl_cffi, use_cloudscraper=use_cloudscraper, site_json=site_json)
   if r != None and (r.status_code == 200 or r.status_code == 402):
     return r.content
   return None
 
+# Short-lived credentials that handlers scrape from pages or js bundles (api keys, JWTs, access tokens).
+# Handlers register a fetcher once and call get_token(name) per request. The expiry comes from the JWT exp claim,
+# an "expires" key in a dict token, or the registered ttl. Tokens are refreshed in the background shortly before
+# they expire, and concurrent refreshes of the same token share one fetch.
+token_default_ttl = 3600
+token_refresh_ahead = 300
+token_retry_interval = 60
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+def register_token(name, func_fetch, ttl=0, func_load=None, func_save=None):
+  # func_fetch(**kwargs) returns a new token (or None). func_load() and func_save(token) optionally persist it across restarts.
+  with _tokens_lock:
+    token = _tokens.get(name)
+    if not token:
+      token = {
+        "value": None,
+        "expires": 0,
+        "refresh": 0,
+        "loaded": False,
+        "failed": 0,
+        "refreshing": False,
+        "lock": threading.Lock(),
+        "stats": {"hits": 0, "fetches": 0, "failures": 0}
+      }
+      _tokens[name] = token
+    token['fetch'] = func_fetch
+    token['ttl'] = ttl
+    token['load'] = func_load
+    token['save'] = func_save
+  return token
+
+def get_jwt_expires(value):
+  try:
+    payload = value.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+  except Exception:
+    return 0
+
+def get_token_expires(value, ttl=0):
+  if ttl:
+    return time.time() + ttl
+  expires = 0
+  if isinstance(value, str):
+    expires = get_jwt_expires(value)
+  elif isinstance(value, dict):
+    expires = value.get('expires', 0)
+  if not expires:
+    expires = time.time() + token_default_ttl
+  return expires
+
+def set_token_value(token, value):
+  token['value'] = value
+  token['expires'] = get_token_expires(value, token['ttl'])
+  # Refresh ahead of expiry, but never in the first 80% of a short-lived token's lifetime
+  token['refresh'] = token['expires'] - min(token_refresh_ahead, (token['expires'] - time.time()) / 5)
+
+def fetch_token(name, token, **kwargs):
+  # Called with token['lock'] held
+  token['stats']['fetches'] += 1
+  try:
+    value = token['fetch'](**kwargs)
+  except Exception as e:
+    logger.warning('exception error {} fetching {} token'.format(e.__class__.__name__, name))
+    value = None
+  if not value:
+    token['stats']['failures'] += 1
+    token['failed'] = time.time()
+    return None
+  set_token_value(token, value)
+  token['failed'] = 0
+  if token['save']:
+    try:
+      token['save'](value)
+    except Exception as e:
+      logger.warning('exception error {} saving {} token'.format(e.__class__.__name__, name))
+  return value
+
+def refresh_token(name, token):
+  with token['lock']:
+    if token['refresh'] <= time.time():
+      fetch_token(name, token)
+    token['refreshing'] = False
+
+def get_token(name, rejected=None, **kwargs):
+  # Returns the cached token for name, fetching it if needed. Pass the token an api just refused as rejected
+  # to force a new one; callers that hit the same rejection concurrently all get the single replacement.
+  token = _tokens.get(name)
+  if not token:
+    logger.warning('token {} is not registered'.format(name))
+    return None
+  value = token['value']
+  now = time.time()
+  if value and value != rejected and token['expires'] > now:
+    token['stats']['hits'] += 1
+    if token['refresh'] <= now and not token['refreshing'] and now - token['failed'] > token_retry_interval:
+      token['refreshing'] = True
+      threading.Thread(target=refresh_token, args=(name, token), name='token-' + name, daemon=True).start()
+    return value
+
+  with token['lock']:
+    if not token['loaded']:
+      token['loaded'] = True
+      if token['load']:
+        try:
+          value = token['load']()
+        except Exception as e:
+          logger.warning('exception error {} loading {} token'.format(e.__class__.__name__, name))
+          value = None
+        if value and value != rejected and get_token_expires(value, token['ttl']) > time.time():
+          set_token_value(token, value)
+    # Another caller may have fetched it while we waited
+    value = token['value']
+    if value and value != rejected and token['expires'] > time.time():
+      token['stats']['hits'] += 1
+      return value
+    if time.time() - token['failed'] < token_retry_interval:
+      return None
+    return fetch_token(name, token, **kwargs)
+
+def get_token_stats():
+  stats = {}
+  for name, token in list(_tokens.items()):
+    stats[name] = token['stats'].copy()
+    stats[name]['expires_in'] = max(0, int(token['expires'] - time.time())) if token['value'] else 0
+  return stats
+
+# Resolved short links almost never change, so they are kept on disk across restarts.
+# Entries are {url: [redirect_url, expires]}. Urls that turn out not to redirect are kept for a shorter time.
+redirect_cache_ttl = 30 * 24 * 3600
+redirect_cache_negative_ttl = 24 * 3600
+redirect_cache_max_items = 50000
+# Signed or expiring links (CDN media urls etc.) stop working long before the ttl, so they are not cached
+redirect_cache_signed_params = {'expires', 'exp', 'signature', 'sig', 'policy', 'token', 'key-pair-id', 'x-amz-expires', 'x-amz-signature', 'x-goog-expires', 'x-goog-signature', 'hdnts', 'hmac'}
+_redirect_cache = {
+  "filename": './redirects_cache.json',
+  "flush_interval": 10,
+  "loaded": False,
+  "urls": {},
+  "dirty": False,
+  "timer": None
+}
+_redirect_cache_lock = threading.Lock()
+
+# Offline decoders for links whose target can be derived from the url itself: (compiled pattern, func(url) -> url or '')
+_redirect_decoders = []
+
+def add_redirect_decoder(pattern, func):
+  _redirect_decoders.append((re.compile(pattern), func))
+
+def decode_google_news_url(url):
+  redirect_url = get_handler('google').decode_news_url(url)
+  if redirect_url != url:
+    return redirect_url
+  return ''
+
+add_redirect_decoder(r'^https://news\.google\.com/rss/articles/', decode_google_news_url)
+
+def decode_redirect_url(url):
+  for pattern, func in _redirect_decoders:
+    if pattern.search(url):
+      try:
+        return func(url)
+      except Exception as e:
+        logger.warning('exception error {} decoding {}'.format(e.__class__.__name__, url))
+  return ''
+
+def load_redirect_cache():
+  with _redirect_cache_lock:
+    if _redirect_cache['loaded']:
+      return
+    if os.path.isfile(_redirect_cache['filename']) and os.stat(_redirect_cache['filename']).st_size > 0:
+      try:
+        with open(_redirect_cache['filename'], 'r', encoding='utf-8') as f:
+          _redirect_cache['urls'] = json.load(f)
+      except Exception as e:
+        logger.warning('error {} loading {}'.format(e.__class__.__name__, _redirect_cache['filename']))
+    _redirect_cache['loaded'] = True
+
+def flush_redirect_cache():
+  with _redirect_cache_lock:
+    _redirect_cache['timer'] = None
+    if not _redirect_cache['dirty']:
+      return
+    now = time.time()
+    urls = {key: val for key, val in _redirect_cache['urls'].items() if val[1] > now}
+    if len(urls) > redirect_cache_max_items:
+      # Drop the entries closest to expiring
+      urls = dict(sorted(urls.items(), key=lambda it: it[1][1])[-redirect_cache_max_items:])
+    _redirect_cache['urls'] = urls
+    data = json.dumps(urls)
+    _redirect_cache['dirty'] = False
+  tmp_filename = _redirect_cache['filename'] + '.tmp'
+  try:
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+      f.write(data)
+    os.replace(tmp_filename, _redirect_cache['filename'])
+  except Exception as e:
+    logger.warning('error {} writing {}'.format(e.__class__.__name__, _redirect_cache['filename']))
+    with _redirect_cache_lock:
+      _redirect_cache['dirty'] = True
+
+atexit.register(flush_redirect_cache)
+
+def get_cached_redirect_url(url):
+  if not _redirect_cache['loaded']:
+    load_redirect_cache()
+  entry = _redirect_cache['urls'].get(url)
+  if entry and entry[1] > time.time():
+    cache_utils.cache_count('redirects', 'hits')
+    return entry[0]
+  cache_utils.cache_count('redirects', 'misses')
+  return ''
+
+def is_signed_url(url):
+  query = urlsplit(url).query
+  if not query:
+    return False
+  return any(key.lower() in redirect_cache_signed_params for key in parse_qs(query, keep_blank_values=True).keys())
+
+def set_cached_redirect_url(url, redirect_url):
+  if is_signed_url(redirect_url):
+    return
+  if not _redirect_cache['loaded']:
+    load_redirect_cache()
+  if redirect_url != url:
+    ttl = redirect_cache_ttl
+  else:
+    ttl = redirect_cache_negative_ttl
+  with _redirect_cache_lock:
+    _redirect_cache['urls'][url] = [redirect_url, int(time.time() + ttl)]
+    _redirect_cache['dirty'] = True
+    if not _redirect_cache['timer']:
+      _redirect_cache['timer'] = threading.Timer(_redirect_cache['flush_interval'], flush_redirect_cache)
+      _redirect_cache['timer'].daemon = True
+      _redirect_cache['timer'].start()
+  cache_utils.cache_count('redirects', 'stores')
+
+def get_redirect_cache_stats():
+  stats = cache_utils.cache_stats().get('redirects', {}).copy()
+  stats['items'] = len(_redirect_cache['urls'])
+  return stats
+
 def find_redirect_url(url):
   #print(url)
   split_url = urlsplit(url)
@@ -577,7 +1597,7 @@ def find_redirect_url(url):
     elif split_url.netloc == 'discounthero.org':
       page_html = get_url_html(url)
       if page_html:
-        soup = BeautifulSoup(page_html, 'lxml')
+        soup = get_soup(page_html)
         el = soup.find('iframe', id='offer')
         if el:
           return find_redirect_url(el['src'])
@@ -615,22 +1635,34 @@ def find_redirect_url(url):
   return ''
 
 def get_redirect_url(url):
+  redirect_url = decode_redirect_url(url)
+  if redirect_url:
+    return redirect_url
+
+  redirect_url = get_cached_redirect_url(url)
+  if redirect_url:
+    return redirect_url
+
   redirect_url = find_redirect_url(url)
   if redirect_url:
+    set_cached_redirect_url(url, redirect_url)
     return redirect_url
 
   # It would be better to use requests.head because some servers may not support the Range header and the whole file will be downloaded; however, request.get seems to work better for getting redirects
   i = 0
   r = None
+  session = get_http_session('requests', False, True, 0)
   try:
     redirect_url = url
-    r = requests.get(url, headers={"Range": "bytes=0-100"}, allow_redirects=False, timeout=5)
+    r = session.get(url, headers={"Range": "bytes=0-100"}, allow_redirects=False, timeout=5)
     while r.is_redirect and i < 5:
       if not re.search(r'^https?:\/\/', r.headers['location']):
         break
+      r.close()
       redirect_url = r.headers['location']
-      r = requests.get(redirect_url, headers={"Range": "bytes=0-100"}, allow_redirects=False, timeout=5)
+      r = session.get(redirect_url, headers={"Range": "bytes=0-100"}, allow_redirects=False, timeout=5)
       i += 1
+    r.close()
     redirect_url = r.url
   except Exception as e:
     if r:
@@ -639,75 +1671,67 @@ def get_redirect_url(url):
       status_code = ''
     logger.debug('exception error {}{} getting {}'.format(e.__class__.__name__, status_code, redirect_url))
     #return get_redirect_url(redirect_url)
-  url = find_redirect_url(redirect_url)
-  if url:
-    return url
+    r = None
+  find_url = find_redirect_url(redirect_url)
+  if find_url:
+    redirect_url = find_url
+  # Only remember completed lookups; errors may be transient
+  if r is not None and r.status_code < 500:
+    set_cached_redirect_url(url, redirect_url)
   return redirect_url
 
 def get_url_title_desc(url):
-  html = get_url_html(url)
-  if html:
-    soup = BeautifulSoup(html, 'html.parser')
-    el = soup.find('title')
-    if el:
-      title = el.get_text()
-    else:
-      title = url
-    el = soup.find('meta', attrs={"name": "description"})
-    if el:
-      desc = el['content']
-    else:
-      desc = None
+  page_meta = get_page_meta_fast(url)
+  if page_meta:
+    title = page_meta['title'] or url
+    desc = page_meta['meta'].get('description')
   else:
     title = url
     desc = None
   return title, desc
 
 def post_url(url, data=None, json_data=None, headers=None, r_text=False, use_proxy=False, use_curl_cffi=False, site_json=None):
-  if use_proxy:
-    proxies = config.proxies
-  else:
-    proxies = None
+  cache_key = ''
+  if site_json and 'cache_ttl' in site_json and not site_json.get('no_cache'):
+    cache_key = get_response_cache_key('POST', url, headers, data if data else json_data, '', use_proxy, use_curl_cffi)
+    r = cache_utils.cache_get('responses', cache_key)
+    if r != None:
+      if r_text:
+        return r.text
+      try:
+        return r.json()
+      except:
+        logger.warning('error converting to json: {}'.format(url))
+        return None
+
   if use_curl_cffi:
+    session = get_http_session('curl_cffi', use_proxy, True, 0)
     try:
-      if data:
-        if headers:
-          r = curl_cffi.post(url, data=data, headers=headers, impersonate=config.impersonate, proxies=proxies)
+      with http_host_slot(url):
+        if data:
+          r = session.post(url, data=data, headers=headers)
+        elif json_data:
+          r = session.post(url, json=json_data, headers=headers)
         else:
-          r = curl_cffi.post(url, data=data, impersonate=config.impersonate, proxies=proxies)
-      elif json_data:
-        if headers:
-          r = curl_cffi.post(url, json=json_data, headers=headers, impersonate=config.impersonate, proxies=proxies)
-        else:
-          r = curl_cffi.post(url, json=json_data, impersonate=config.impersonate, proxies=proxies)
-      else:
-        if headers:
-          r = curl_cffi.post(url, headers=headers, impersonate=config.impersonate, proxies=proxies)
-        else:
-          r = curl_cffi.post(url, impersonate=config.impersonate, proxies=proxies)
+          r = session.post(url, headers=headers)
       r.raise_for_status()
     except requests.exceptions.HTTPError as e:
       status_code = e.response.status_code
       logger.warning('curl_cffi status code {} requesting {}'.format(e.response.status_code, url))
       if status_code != 402:
         return None
+    finally:
+      release_http_session('curl_cffi', session, use_proxy, True)
   else:
+    session = get_http_session('requests', False, True, 0)
     try:
-      if data:
-        if headers:
-          r = requests.post(url, data=data, headers=headers)
+      with http_host_slot(url):
+        if data:
+          r = session.post(url, data=data, headers=headers)
+        elif json_data:
+          r = session.post(url, json=json_data, headers=headers)
         else:
-          r = requests.post(url, data=data)
-      elif json_data:
-        if headers:
-          r = requests.post(url, json=json_data, headers=headers)
-        else:
-          r = requests.post(url, json=json_data)
-      else:
-        if headers:
-          r = requests.post(url, headers=headers)
-        else:
-          r = requests.post(url)
+          r = session.post(url, headers=headers)
       r.raise_for_status()
     except requests.exceptions.HTTPError as e:
       status_code = e.response.status_code
@@ -721,6 +1745,8 @@ def post_url(url, data=None, json_data=None, headers=None, r_text=False, use_pro
     except requests.exceptions.Timeout:
       logger.warning('Timeout error requesting {}'.format(url))
       return None
+  if cache_key:
+    cache_response(cache_key, r, site_json)
   if r_text:
     return r.text
   else:
@@ -749,7 +1775,88 @@ def url_exists(url):
     logger.warning('requests exception error {} getting {}'.format(e.__class__.__name__, url))
     return None
 
+# Debug artifacts. Files written to ./debug/ (e.g. write_file(content_html, './debug/debug.html')) are
+# skipped unless debug is enabled for the current request. When it is, they're written in the background
+# into a per-request directory (./debug/<request id>/) so concurrent requests don't overwrite each other.
+# Files are truncated at debug_max_file_size and only the newest debug_max_requests directories are kept.
+debug_dir = './debug'
+debug_max_file_size = 5 * 1024 * 1024
+debug_max_requests = 20
+_debug_request_dir = contextvars.ContextVar('debug_request_dir', default=None)
+_debug_executor = None
+_debug_executor_lock = threading.Lock()
+
+def get_debug_executor():
+  global _debug_executor
+  if not _debug_executor:
+    with _debug_executor_lock:
+      if not _debug_executor:
+        _debug_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='debug')
+  return _debug_executor
+
+def start_debug_request(save_debug):
+  # Call at the start of a request. Returns the request's debug directory, or None if debug is off.
+  if not save_debug:
+    _debug_request_dir.set(None)
+    return None
+  request_dir = os.path.join(debug_dir, datetime.now().strftime('%Y%m%d-%H%M%S-') + random_alphanumeric_string(4))
+  _debug_request_dir.set(request_dir)
+  get_debug_executor().submit(prune_debug_requests)
+  return request_dir
+
+def get_debug_request_dir():
+  return _debug_request_dir.get()
+
+def prune_debug_requests():
+  if not os.path.isdir(debug_dir):
+    return
+  try:
+    request_dirs = sorted(it.path for it in os.scandir(debug_dir) if it.is_dir())
+    for request_dir in request_dirs[:-debug_max_requests]:
+      for root, dirs, files in os.walk(request_dir, topdown=False):
+        for it in files:
+          os.remove(os.path.join(root, it))
+        for it in dirs:
+          os.rmdir(os.path.join(root, it))
+      os.rmdir(request_dir)
+  except Exception as e:
+    logger.warning('error {} pruning debug directories'.format(e.__class__.__name__))
+
+def is_debug_file(filename):
+  return os.path.normpath(filename).split(os.sep)[0] == os.path.normpath(debug_dir)
+
+def write_debug_file(data, filename):
+  request_dir = _debug_request_dir.get()
+  if not request_dir:
+    return
+  debug_filename = os.path.join(request_dir, os.path.relpath(os.path.normpath(filename), os.path.normpath(debug_dir)))
+  # Serialize now since the caller may keep modifying the data
+  try:
+    if filename.endswith('.json'):
+      data = json.dumps(data, indent=4, sort_keys=True)
+    else:
+      data = str(data)
+  except Exception as e:
+    logger.warning('error {} serializing {}'.format(e.__class__.__name__, filename))
+    return
+  get_debug_executor().submit(save_debug_file, data, debug_filename)
+
+def save_debug_file(data, filename):
+  try:
+    if len(data) > debug_max_file_size:
+      data = data[:debug_max_file_size]
+    elif filename.endswith('.html'):
+      data = BeautifulSoup(data, 'html.parser').prettify()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w', encoding='utf-8') as f:
+      f.write(data)
+  except Exception as e:
+    logger.warning('error {} writing {}'.format(e.__class__.__name__, filename))
+
 def write_file(data, filename):
+  if is_debug_file(filename):
+    write_debug_file(data, filename)
+    return
   if filename.endswith('.json'):
     with open(filename, 'w', encoding='utf-8') as f:
       json.dump(data, f, indent=4, sort_keys=True)
@@ -917,22 +2024,28 @@ def random_alphanumeric_string(str_len=8):
   letters_digits = string.ascii_letters + string.digits
   return ''.join((random.choice(letters_digits) for i in range(str_len)))
 
-def check_regex_filter(item, filters):
-  # Note: any match returns True
-  # TODO: handle cases where all filters must match
-
+@functools.lru_cache(maxsize=1024)
+def compile_filter_regex(value):
   # Simple conversion to Python style regex
   # Note: filter should a dict of form: {'tag': '/regex/i'}
   # - Remove begining and ending /'s
   # - Check for flags - only 'i' supported now
-  for tag in filters.keys():
-    m = re.match(r"^/(.*)/(i?)$", filters[tag])
-    pattern = m.group(1)
-    flags = 0
-    if m.group(2) == 'i':
-      flags = re.I
-    r = re.compile(pattern, flags)
+  m = re.match(r"^/(.*)/(i?)$", value)
+  flags = 0
+  if m.group(2) == 'i':
+    flags = re.I
+  return re.compile(m.group(1), flags)
 
+def compile_regex_filters(filters):
+  if isinstance(filters, dict):
+    return tuple((tag, compile_filter_regex(val)) for tag, val in filters.items())
+  return filters
+
+def check_regex_filter(item, filters):
+  # Note: any match returns True
+  # TODO: handle cases where all filters must match
+  # filters is either the {'tag': '/regex/i'} dict or the compiled tuple from compile_regex_filters
+  for tag, r in compile_regex_filters(filters):
     # Handle lists & strings
     if tag in item:
       if isinstance(item[tag], list):
@@ -961,33 +2074,133 @@ def check_age(item, args):
       return False
   return True
 
-def filter_item(item, args):
+@functools.lru_cache(maxsize=256)
+def compile_feed_filter(exc_filters, inc_filters, max_items):
+  # The filter args are json strings, so the plan is built once per distinct set of args
+  feed_filter = {
+    "exc_filters": compile_regex_filters(json.loads(exc_filters)) if exc_filters else (),
+    "inc_filters": compile_regex_filters(json.loads(inc_filters)) if inc_filters else (),
+    "max": int(max_items) if max_items else 0
+  }
+  return feed_filter
+
+def get_feed_filter(args):
+  return compile_feed_filter(args.get('exc_filters'), args.get('inc_filters'), args.get('max'))
+
+def filter_item(item, args, partial=False):
   # Returns:
   #  True = include the item
   #  False = exclude the item
+  # With partial=True the item only has the cheap listing metadata (title, date, tags...) of a feed entry, so
+  # include filters on tags it doesn't have can't rule it out yet. The full item should be checked again.
 
   # Check item age (in hours)
   # Note: age overrides other filters
   if not check_age(item, args):
     return False
 
+  feed_filter = get_feed_filter(args)
+
   # Note: A matched exclude filter will take precedent over a matched include filter
   # Check exclude filters
-  if 'exc_filters' in args:
-    filters = json.loads(args['exc_filters'])
-    exc = check_regex_filter(item, filters)
-    if exc == True:
+  if feed_filter['exc_filters']:
+    if check_regex_filter(item, feed_filter['exc_filters']):
       return False
 
   # Check include filters
-  if 'inc_filters' in args:
-    filters = json.loads(args('inc_filters'))
-    inc = check_regex_filter(item, filters)
-    if inc == False:
-      return False
+  if feed_filter['inc_filters']:
+    if not check_regex_filter(item, feed_filter['inc_filters']):
+      if not partial or all(tag in item for tag, r in feed_filter['inc_filters']):
+        return False
 
   return True
 
+# Feed item expansion (getting the full content for each feed item) runs on a shared thread pool.
+# The number of concurrent fetches to the same host is capped and the whole feed has a deadline:
+# items keep their original order and any item that isn't done in time is returned as None so the
+# caller can fall back to the feed summary.
+feed_expand_workers = 16
+feed_expand_host_limit = 4
+feed_expand_deadline = 30
+_feed_executor = None
+_feed_executor_lock = threading.Lock()
+
+def get_feed_executor():
+  global _feed_executor
+  if not _feed_executor:
+    with _feed_executor_lock:
+      if not _feed_executor:
+        _feed_executor = concurrent.futures.ThreadPoolExecutor(max_workers=feed_expand_workers, thread_name_prefix='feed')
+  return _feed_executor
+
+def expand_feed_items(items, func_get_item, func_get_url, deadline=0, executor=None, host_limit=0, func_filter=None, limit=0, func_fallback=None):
+  # func_get_item(item) returns the expanded item, func_get_url(item) the url it will be fetched from
+  # Expanded items that fail func_filter(item) are returned as None. With a limit, no more items are started
+  # once the accepted and in-flight items could fill it, and expansion stops when limit items are accepted.
+  # Items that haven't finished by the deadline are returned as None, or as func_fallback(item) if given
+  # (a summary item built from the listing, which also has to pass func_filter).
+  if not deadline:
+    deadline = feed_expand_deadline
+  if not executor:
+    executor = get_feed_executor()
+  if not host_limit:
+    host_limit = feed_expand_host_limit
+  end_time = time.monotonic() + float(deadline)
+  results = [None] * len(items)
+  pending = list(range(len(items)))
+  running = {}
+  host_count = {}
+  accepted = 0
+
+  def submit_items():
+    for i in pending.copy():
+      if limit and accepted + len(running) >= limit:
+        break
+      host = urlsplit(func_get_url(items[i])).netloc
+      if host_count.get(host, 0) < host_limit:
+        pending.remove(i)
+        host_count[host] = host_count.get(host, 0) + 1
+        # Run in a copy of the current context so any per-request context vars carry over
+        ctx = contextvars.copy_context()
+        running[executor.submit(ctx.run, func_get_item, items[i])] = (i, host)
+
+  submit_items()
+  while running:
+    timeout = end_time - time.monotonic()
+    if timeout <= 0:
+      break
+    done, not_done = concurrent.futures.wait(running.keys(), timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+      i, host = running.pop(future)
+      host_count[host] -= 1
+      try:
+        results[i] = future.result()
+      except Exception as e:
+        logger.warning('exception {} getting content for {}'.format(e.__class__.__name__, func_get_url(items[i])))
+      if results[i] and func_filter and not func_filter(results[i]):
+        results[i] = None
+      if results[i]:
+        accepted += 1
+    if limit and accepted >= limit:
+      pending.clear()
+      break
+    submit_items()
+
+  if running or pending:
+    logger.warning('deadline of {}s reached with {} items unfinished'.format(deadline, len(running) + len(pending)))
+    for future in running.keys():
+      future.cancel()
+    if func_fallback:
+      for i in sorted([i for i, host in running.values()] + pending):
+        if limit and accepted >= limit:
+          break
+        results[i] = func_fallback(items[i])
+        if results[i] and func_filter and not func_filter(results[i]):
+          results[i] = None
+        if results[i]:
+          accepted += 1
+  return results
+
 def bs_get_inner_html(soup):
   # Also strips \n
   return re.sub(r'^<[^>]+>|<\/[^>]+>$|\n', '', str(soup))
@@ -2049,7 +3262,7 @@ def add_video(video_url, video_type, poster='', caption='', img_style='width:100
       video_src += '&poster=' + quote_plus(poster)
 
   elif video_type == 'vimeo':
-    content = vimeo.get_content(video_url, {}, {}, False)
+    content = get_handler('vimeo').get_content(video_url, {}, {}, False)
     if content.get('_image'):
       poster = content['_image']
     video_src = '{}/video?url={}'.format(config.server, quote_plus(video_url))
@@ -2057,7 +3270,7 @@ def add_video(video_url, video_type, poster='', caption='', img_style='width:100
       caption = '{} | <a href="{}" target="_blank">Watch on Vimeo</a>'.format(content['title'], video_url)
 
   elif video_type == 'youtube':
-    content = youtube.get_content(video_url, {}, {}, False)
+    content = get_handler('youtube').get_content(video_url, {}, {}, False)
     if content:
       if content.get('_image'):
         poster = content['_image']
@@ -2464,7 +3677,91 @@ def format_table(table, table_border='border-collapse:collapse; border:1px solid
     if cell_border:
       td['style'] += ' ' + cell_border
 
+# Two-phase embeds: while a handler builds an item inside get_cached_content, add_embed only records the
+# url and returns a placeholder token. Once the handler returns, the embeds are resolved concurrently (with
+# per-host limits and a deadline) and spliced into the item. Embeds that don't finish in time become a link card.
+# Handlers that need to inspect the embed html right away can call resolve_embeds(add_embed(...)).
+embed_workers = 16
+embed_host_limit = 2
+embed_deadline = 15
+_embed_batch = contextvars.ContextVar('embed_batch', default=None)
+_embed_executor = None
+_embed_executor_lock = threading.Lock()
+
+def get_embed_executor():
+  global _embed_executor
+  if not _embed_executor:
+    with _embed_executor_lock:
+      if not _embed_executor:
+        _embed_executor = concurrent.futures.ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix='embed')
+  return _embed_executor
+
+def get_embed_link_card(url):
+  return '<blockquote><b>Embedded content from <a href="{0}">{0}</a></b></blockquote>'.format(url)
+
+def resolve_embed(embed):
+  # Runs in a copy of the request context. Nested embeds are resolved inline so that embed workers never wait on each other.
+  _embed_batch.set(False)
+  return add_embed(embed['url'], embed['args'], embed['save_debug'])
+
+def splice_embeds(obj, embeds):
+  if isinstance(obj, str):
+    if '{{embed:' in obj:
+      return re.sub(r'\{\{embed:([0-9a-f]+)\}\}', lambda m: embeds.get(m.group(1), ''), obj)
+  elif isinstance(obj, dict):
+    for key, val in obj.items():
+      obj[key] = splice_embeds(val, embeds)
+  elif isinstance(obj, list):
+    for i, val in enumerate(obj):
+      obj[i] = splice_embeds(val, embeds)
+  return obj
+
+def resolve_embeds(html):
+  # Resolves the embed tokens in html now (in this thread)
+  batch = _embed_batch.get()
+  if not batch or '{{embed:' not in html:
+    return html
+  embeds = {}
+  for key in re.findall(r'\{\{embed:([0-9a-f]+)\}\}', html):
+    if key in batch:
+      embed = batch.pop(key)
+      ctx = contextvars.copy_context()
+      embeds[key] = ctx.run(resolve_embed, embed)
+  return splice_embeds(html, embeds)
+
+def get_content_with_embeds(func_get_content, url, args, site_json, save_debug=False):
+  # Calls func_get_content(url, args, site_json, save_debug) with two-phase embeds
+  with parse_scope():
+    if _embed_batch.get() is False:
+      return func_get_content(url, args, site_json, save_debug)
+    reset_token = _embed_batch.set({})
+    try:
+      item = func_get_content(url, args, site_json, save_debug)
+      batch = _embed_batch.get()
+    finally:
+      _embed_batch.reset(reset_token)
+    if not batch:
+      return item
+    keys = list(batch.keys())
+    results = expand_feed_items(keys, lambda key: resolve_embed(batch[key]), lambda key: batch[key]['url'], embed_deadline, get_embed_executor(), embed_host_limit)
+    embeds = {}
+    for key, result in zip(keys, results):
+      if result is None:
+        result = get_embed_link_card(batch[key]['url'])
+      embeds[key] = result
+    return splice_embeds(item, embeds)
+
 def add_embed(url, args={}, save_debug=False):
+  batch = _embed_batch.get()
+  if batch is not None and batch is not False:
+    key = secrets.token_hex(8)
+    batch[key] = {
+      "url": url,
+      "args": args.copy(),
+      "save_debug": save_debug
+    }
+    return '{{embed:' + key + '}}'
+
   embed_url = url.strip()
   if url.startswith('//'):
     embed_url = 'https:' + url
@@ -2510,85 +3807,361 @@ def add_embed(url, args={}, save_debug=False):
     embed_args['max'] = 3
 
   module, site_json = get_module(embed_url)
+  if module and site_json.get('args'):
+    embed_args.update(site_json['args'])
+  if save_debug or (site_json and site_json.get('no_cache')):
+    return render_embed(embed_url, url, module, embed_args, site_json, save_debug)[0]
+  key = get_item_cache_key(add_embed, embed_url, embed_args)
+  embed_html = cache_utils.cache_get('embeds', key)
+  if embed_html:
+    return embed_html
+  embed_html, ok = render_embed(embed_url, url, module, embed_args, site_json, save_debug)
+  if not ok:
+    ttl = embed_cache_negative_ttl
+  elif site_json and 'embed_cache_ttl' in site_json:
+    ttl = int(site_json['embed_cache_ttl'])
+  elif site_json and site_json.get('module') in embed_cache_ttls:
+    ttl = embed_cache_ttls[site_json['module']]
+  else:
+    ttl = embed_cache_ttl
+  cache_utils.cache_set('embeds', key, embed_html, ttl, size=len(embed_html))
+  return embed_html
+
+# Rendered embed html, keyed by the canonical embed url and the embed args. Social posts change (counts,
+# edits, deletions) so they're kept briefly, static charts and documents for much longer. Failed embeds
+# (the link card) are cached for embed_cache_negative_ttl so a dead embed isn't refetched for every article.
+# embed_cache_ttls is keyed by the sites.json module of the embed (e.g. YouTube is ytdl, Truth Social is mastodon).
+embed_cache_ttl = 3600
+embed_cache_negative_ttl = 300
+embed_cache_max_size = 32 * 1024 * 1024
+embed_cache_ttls = {
+  "bluesky": 300,
+  "facebook": 600,
+  "instagram": 600,
+  "mastodon": 300,
+  "reddit": 300,
+  "threads": 300,
+  "tiktok": 900,
+  "twitter": 300,
+  "apple": 86400,
+  "bandcamp": 86400,
+  "soundcloud": 86400,
+  "spotify": 86400,
+  "vimeo": 86400,
+  "ytdl": 86400,
+  "datawrapper": 7 * 86400,
+  "documentcloud": 7 * 86400,
+  "flourish": 7 * 86400,
+  "infogram": 7 * 86400,
+  "knightlab": 7 * 86400,
+  "scribd": 7 * 86400
+}
+cache_utils.init_cache('embeds', max_size=embed_cache_max_size)
+
+def render_embed(embed_url, url, module, embed_args, site_json, save_debug=False):
+  # Returns (embed html, False if it's only the fallback link card)
   if module:
-    if site_json.get('args'):
-        embed_args.update(site_json['args'])
     content = module.get_content(embed_url, embed_args, site_json, save_debug)
     if content:
-      return content['content_html']
+      return content['content_html'], True
 
   if 'eliteprospects.com/iframe_player_stats.php' in embed_url:
-    return add_image(config.server + '/screenshot?wait_until=domcontentloaded&waitfortime=5000&locator=body+%3E+p&url=' + quote_plus(embed_url), link=embed_url)
+    return add_image(config.server + '/screenshot?wait_until=domcontentloaded&waitfortime=5000&locator=body+%3E+p&url=' + quote_plus(embed_url), link=embed_url), True
 
-  page_html = get_url_html(embed_url)
-  if page_html:
-    soup = BeautifulSoup(page_html, 'lxml')
+  page_meta = get_page_meta_fast(embed_url)
+  if page_meta:
+    meta = page_meta['meta']
     item = {}
-    el = soup.find('meta', attrs={"property": "og:url"})
-    if el:
-      item['url'] = el['content'].strip()
+    if meta.get('og:url') or meta.get('twitter:url'):
+      item['url'] = (meta.get('og:url') or meta['twitter:url']).strip()
     else:
-      el = soup.find('meta', attrs={"name": "twitter:url"})
-      if el:
-        item['url'] = el['content'].strip()
-      else:
-        item['url'] = embed_url
+      item['url'] = embed_url
 
-    el = soup.find('meta', attrs={"property": "og:title"})
-    if el:
-      item['title'] = el['content'].strip()
+    if meta.get('og:title') or meta.get('twitter:title'):
+      item['title'] = (meta.get('og:title') or meta['twitter:title']).strip()
+    elif page_meta['title']:
+      item['title'] = page_meta['title'].strip()
     else:
-      el = soup.find('meta', attrs={"name": "twitter:title"})
-      if el:
-        item['title'] = el['content'].strip()
-      else:
-        el = soup.find('title')
-        if el:
-          item['title'] = el.get_text().strip()
-        else:
-          item['title'] = url
-
-    el = soup.find('meta', attrs={"property": "og:image"})
-    if el:
-      item['image'] = el['content']
-    else:
-      el = soup.find('meta', attrs={"name": "twitter:image"})
-      if el:
-        item['image'] = el['content'].strip()
-
-    el = soup.find('meta', attrs={"property": "og:description"})
-    if el:
-      item['summary'] = el['content'].strip()
+      item['title'] = url
+
+    if meta.get('og:image') or meta.get('twitter:image'):
+      item['image'] = (meta.get('og:image') or meta['twitter:image']).strip()
+
+    if meta.get('og:description') or meta.get('description'):
+      item['summary'] = (meta.get('og:description') or meta['description']).strip()
+
+    return format_embed_preview(item), True
+
+  return get_embed_link_card(embed_url), False
+
+# Cache of rendered content items, shared by /content, feed item expansion and get_content. Items are
+# keyed by the normalized url, the handler function (and the mtime of its module file so that editing a
+# handler invalidates its items) and the args that can change the output, so feed-only args (filters, max,
+# age, deadline) are left out and a feed's items are the same cache entries as /content. An item is re-rendered after
+# item_cache_ttl seconds (or the site's "item_cache_ttl"), or sooner if the feed lists a different date_modified.
+item_cache_ttl = 900
+item_cache_max_size = 64 * 1024 * 1024
+item_cache_ignore_args = {'url', 'read', 'debug', 'feedhandler', 'feedtype', 'deadline', 'ai_summary', 'age', 'max', 'inc_filters', 'exc_filters'}
+cache_utils.init_cache('items', max_size=item_cache_max_size)
+
+def normalize_url(url):
+  # Lowercase the scheme & host, drop the fragment, tracking params and any trailing slash
+  split_url = urlsplit(url.strip())
+  path = split_url.path
+  if path.endswith('/'):
+    path = path[:-1]
+  query = '&'.join(sorted(it for it in split_url.query.split('&') if it and not re.search(r'^(utm_|fbclid=|gclid=)', it)))
+  normalized_url = '{}://{}{}'.format(split_url.scheme.lower(), split_url.netloc.lower(), path)
+  if query:
+    normalized_url += '?' + query
+  return normalized_url
+
+def get_handler_version(func):
+  module = sys.modules.get(func.__module__)
+  if module and getattr(module, '__file__', None):
+    try:
+      return '{}.{}:{}'.format(func.__module__, func.__name__, os.stat(module.__file__).st_mtime_ns)
+    except OSError:
+      pass
+  return '{}.{}'.format(func.__module__, func.__name__)
+
+def get_item_cache_key(func_get_content, url, args):
+  key_args = sorted((key, str(val)) for key, val in args.items() if key not in item_cache_ignore_args)
+  return '{} {} {}'.format(get_handler_version(func_get_content), normalize_url(url), json.dumps(key_args))
+
+def get_cached_content(func_get_content, url, args, site_json, save_debug=False, date_modified='', func_fetch=None):
+  # Calls func_get_content(url, args, site_json, save_debug) unless there's a cached item. A feed that already
+  # has the item's data can pass func_fetch (same signature) to build it instead, still cached under func_get_content.
+  if not func_fetch:
+    func_fetch = func_get_content
+  if save_debug or (site_json and site_json.get('no_cache')):
+    return get_content_with_embeds(func_fetch, url, args, site_json, save_debug)
+  key = get_item_cache_key(func_get_content, url, args)
+  item = cache_utils.cache_get('items', key)
+  if item and date_modified and item.get('date_modified'):
+    try:
+      if datetime.fromisoformat(date_modified.replace('Z', '+00:00')) > datetime.fromisoformat(item['date_modified'].replace('Z', '+00:00')):
+        logger.debug('content modified ' + url)
+        item = None
+    except:
+      pass
+  if item:
+    # Callers modify the items they get back
+    return copy.deepcopy(item)
+  item = get_content_with_embeds(func_fetch, url, args, site_json, save_debug)
+  if item:
+    if site_json and 'item_cache_ttl' in site_json:
+      ttl = int(site_json['item_cache_ttl'])
     else:
-      el = soup.find('meta', attrs={"name": "description"})
-      if el:
-        item['summary'] = el['content'].strip()
-
-    return format_embed_preview(item, False)
+      ttl = item_cache_ttl
+    size = len(item.get('content_html', '')) + len(item.get('summary', '')) + 1024
+    cache_utils.cache_set('items', key, copy.deepcopy(item), ttl, size)
+  return item
 
-  return '<blockquote><b>Embedded content from <a href="{0}">{0}</a></b></blockquote>'.format(embed_url)
-
-def get_content(url, args, save_debug=False):
+def get_content(url, args, save_debug=False, date_modified=''):
   module, site_json = get_module(url)
   if not module:
     return None
   args_copy = args.copy()
   if site_json.get('args'):
       args_copy.update(site_json['args'])
-  return module.get_content(url, args_copy, site_json, save_debug)
-
-def get_ld_json(url, soup=None, site_json=None):
-  if not soup:
-    page_html = get_url_html(url, site_json=site_json)
-    if not page_html:
+  return get_cached_content(module.get_content, url, args_copy, site_json, save_debug, date_modified)
+
+# Shared HTML parsing. Full pages are parsed with the lxml tree builder (get_soup), which is several times faster
+# than html.parser. Within a parse scope (one content request, including its embeds) page metadata is cached per
+# document, so a page that add_embed, get_ld_json and parse_next_data all look at is only parsed once.
+html_parser = 'lxml'
+_parsed_docs = contextvars.ContextVar('parsed_docs', default=None)
+
+@contextlib.contextmanager
+def parse_scope():
+  if _parsed_docs.get() is not None:
+    yield
+    return
+  reset_token = _parsed_docs.set({})
+  try:
+    yield
+  finally:
+    _parsed_docs.reset(reset_token)
+
+def get_parsed_doc(key, func_parse):
+  docs = _parsed_docs.get()
+  if docs is None:
+    return func_parse()
+  if key not in docs:
+    docs[key] = func_parse()
+  return docs[key]
+
+def get_soup(markup, parser=''):
+  if not parser:
+    parser = html_parser
+  return BeautifulSoup(markup, parser)
+
+def parse_page_meta(page_html):
+  page_meta = {
+    "title": "",
+    "meta": {},
+    "ld_json": [],
+    "next_data": None
+  }
+  try:
+    if isinstance(page_html, str) and re.match(r'\s*<\?xml', page_html):
+      # lxml refuses str input with an encoding declaration
+      page_html = page_html.encode('utf-8')
+    doc = lxml.html.document_fromstring(page_html)
+  except Exception as e:
+    logger.warning('exception error {} parsing page metadata'.format(e.__class__.__name__))
+    return page_meta
+  el = doc.find('.//title')
+  if el is not None:
+    page_meta['title'] = el.text_content()
+  # Keep the first of each like soup.find would
+  for el in doc.iterfind('.//meta[@content]'):
+    for attr in ('property', 'name', 'itemprop'):
+      key = el.get(attr)
+      if key and key not in page_meta['meta']:
+        page_meta['meta'][key] = el.get('content')
+  for el in doc.xpath('//script[@type="application/ld+json"]'):
+    try:
+      page_meta['ld_json'].append(json.loads(el.text))
+    except Exception as e:
+      logger.debug('exception error {} loading ld+json'.format(e.__class__.__name__))
+  el = doc.xpath('//script[@id="__NEXT_DATA__"]')
+  if el:
+    try:
+      page_meta['next_data'] = json.loads(el[0].text)
+    except Exception as e:
+      logger.debug('exception error {} loading __NEXT_DATA__'.format(e.__class__.__name__))
+  return page_meta
+
+def get_page_meta(page_html):
+  # Selector-only path for metadata (title, meta tags, ld+json and __NEXT_DATA__) that skips building a soup
+  return get_parsed_doc(('meta', page_html), lambda: parse_page_meta(page_html))
+
+def parse_next_data(page_html):
+  # The page's __NEXT_DATA__ json, or None
+  if not page_html:
+    return None
+  return get_page_meta(page_html)['next_data']
+
+# Head-only metadata for link previews: the page is streamed and parsed incrementally until </head> (or the
+# first body element, or head_meta_max_bytes), then the connection is dropped. Returns the same dict as
+# get_page_meta plus the <link> hrefs by rel, or None if the page couldn't be fetched or isn't html.
+head_meta_max_bytes = 256 * 1024
+head_meta_chunk_size = 8192
+head_meta_timeout = 10
+head_meta_ttl = 3600
+cache_utils.init_cache('head_meta', max_items=4096)
+
+def parse_head_meta(chunks, encoding=None):
+  head_meta = {
+    "title": "",
+    "meta": {},
+    "links": {},
+    "ld_json": [],
+    "next_data": None
+  }
+  parser = None
+  size = 0
+  done = False
+  for chunk in chunks:
+    if not parser:
+      if not encoding and not re.search(rb'<meta[^>]+charset=', chunk[:4096], flags=re.I):
+        # No charset in the header or a <meta>: lxml would fall back to latin-1, while the full parse
+        # (requests' detection) gets utf-8 for utf-8 pages, so use utf-8 if the start decodes as utf-8
+        try:
+          chunk[:4096].decode('utf-8')
+          encoding = 'utf-8'
+        except UnicodeDecodeError as e:
+          if e.start >= len(chunk[:4096]) - 3:
+            encoding = 'utf-8'
+      parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+    parser.feed(chunk)
+    size += len(chunk)
+    for event, el in parser.read_events():
+      if event == 'start':
+        if el.tag == 'body':
+          done = True
+          break
+        continue
+      if el.tag == 'head':
+        done = True
+        break
+      elif el.tag == 'title':
+        if not head_meta['title']:
+          head_meta['title'] = el.text or ''
+      elif el.tag == 'meta':
+        if el.get('content') is not None:
+          for attr in ('property', 'name', 'itemprop'):
+            key = el.get(attr)
+            if key and key not in head_meta['meta']:
+              head_meta['meta'][key] = el.get('content')
+      elif el.tag == 'link':
+        if el.get('rel') and el.get('href'):
+          for rel in el.get('rel').lower().split():
+            if rel not in head_meta['links']:
+              head_meta['links'][rel] = el.get('href')
+      elif el.tag == 'script':
+        if el.get('type') == 'application/ld+json' and el.text:
+          try:
+            head_meta['ld_json'].append(json.loads(el.text))
+          except Exception as e:
+            logger.debug('exception error {} loading ld+json'.format(e.__class__.__name__))
+    if done or size >= head_meta_max_bytes:
+      break
+  return head_meta
+
+def get_head_meta(url):
+  head_meta = cache_utils.cache_get('head_meta', url)
+  if head_meta:
+    return head_meta
+  session = get_http_session('requests', False, True, 0)
+  r = None
+  try:
+    # Only the user-agent from the pool headers: the body is decoded as it streams, and only gzip/deflate are always available
+    headers = {
+      "user-agent": get_pool_headers('desktop')['User-Agent'],
+      "accept-encoding": "gzip, deflate"
+    }
+    r = session.get(url, headers=headers, stream=True, timeout=head_meta_timeout)
+    if r.status_code != 200:
+      logger.debug('status code {} getting head of {}'.format(r.status_code, url))
+      return None
+    content_type = r.headers.get('content-type', '')
+    if content_type and 'html' not in content_type:
       return None
-    soup = BeautifulSoup(page_html, 'html.parser')
+    m = re.search(r'charset=["\']?([\w-]+)', content_type)
+    head_meta = parse_head_meta(r.iter_content(head_meta_chunk_size), m.group(1) if m else None)
+  except Exception as e:
+    logger.debug('exception error {} getting head of {}'.format(e.__class__.__name__, url))
+    return None
+  finally:
+    update_http_stats('requests', 'requests')
+    if r is not None:
+      # The rest of the page isn't read, so this drops the connection instead of returning it to the pool
+      r.close()
+  cache_utils.cache_set('head_meta', url, head_meta, head_meta_ttl)
+  return head_meta
+
+def get_page_meta_fast(url):
+  # Head-only metadata, falling back to the whole page for sites that block the plain request or fill in their head later
+  page_meta = get_head_meta(url)
+  if page_meta and (page_meta['title'] or page_meta['meta']):
+    return page_meta
+  page_html = get_url_html(url)
+  if page_html:
+    return get_page_meta(page_html)
+  return None
+
+def group_ld_json(ld_jsons):
   page_ld_json = {}
-  for el in soup.find_all('script', type='application/ld+json'):
-    ld_json = json.loads(el.string)
+  for ld_json in ld_jsons:
     if isinstance(ld_json, dict):
-      ld = ld_json
-      if ld.get('@type'):
+      ld_json = [ld_json]
+    elif not isinstance(ld_json, list):
+      continue
+    for ld in ld_json:
+      if isinstance(ld, dict) and ld.get('@type'):
         key = ld['@type']
         if key not in page_ld_json:
           page_ld_json[key] = ld
@@ -2597,19 +4170,16 @@ def get_ld_json(url, soup=None, site_json=None):
         else:
           page_ld_json[key] = [page_ld_json[key]]
           page_ld_json[key].append(ld)
-    elif isinstance(ld_json, list):
-      for ld in ld_json:
-        if ld.get('@type'):
-          key = ld['@type']
-          if key not in page_ld_json:
-            page_ld_json[key] = ld
-          elif isinstance(page_ld_json[key], list):
-            page_ld_json[key].append(ld)
-          else:
-            page_ld_json[key] = [page_ld_json[key]]
-            page_ld_json[key].append(ld)
   return page_ld_json
 
+def get_ld_json(url, soup=None, site_json=None):
+  if not soup:
+    page_html = get_url_html(url, site_json=site_json)
+    if not page_html:
+      return None
+    return group_ld_json(get_page_meta(page_html)['ld_json'])
+  return group_ld_json([json.loads(el.string) for el in soup.find_all('script', type='application/ld+json')])
+
 def get_soup_elements(tag, soup):
   if 'recursive' in tag:
     recursive = tag['recursive']
@@ -2648,6 +4218,259 @@ def get_soup_elements(tag, soup):
       elements = soup.find_all(attrs=tag['attrs'], recursive=recursive)
   return elements
 
+# site_json DOM rewrite rules (rename, replace, decompose, unwrap...) compiled into cached programs.
+# Each rule's element filter (the same tag/attrs/regex/selector forms get_soup_elements takes) is compiled
+# once: regexes, a SoupStrainer for tag/attrs filters and a soupsieve selector, plus the parsed replacement
+# html which is copied per match. When no rule depends on an earlier rule's changes, all the rules are matched
+# in one walk of the tree (tag/attrs filters indexed by tag name), then applied in order. Otherwise each rule
+# is matched against the tree as the earlier rules left it. A rule counts as dependent when it could match
+# something an earlier rule created, renamed (to or away from its tag) or rewrote the attributes of, when it
+# is a css selector (any earlier edit can change what a combinator or pseudo-class matches) or when it only
+# matches top-level elements (an earlier unwrap/wrap/replace changes those).
+soup_program_phases = ('rename', 'replace', 'decompose', 'unwrap')
+
+def compile_soup_filter(tag):
+  soup_filter = {
+    "selector": None,
+    "parent": tag.get('parent'),
+    "recursive": tag.get('recursive', True)
+  }
+  if tag.get('selector'):
+    try:
+      soup_filter['selector'] = soupsieve.compile(tag['selector'])
+      soup_filter['selector_text'] = tag['selector']
+    except Exception as e:
+      logger.warning('invalid selector {}: {}'.format(tag['selector'], e.__class__.__name__))
+      return None
+    return soup_filter
+  name = tag.get('tag')
+  attrs = tag.get('attrs', {})
+  if tag.get('regex') in ('tag', 'both'):
+    name = re.compile(name)
+  if tag.get('regex') in ('attrs', 'both'):
+    key = list(attrs.keys())[0]
+    attrs = {key: re.compile(attrs[key])}
+  soup_filter['name'] = name
+  soup_filter['attrs'] = attrs
+  soup_filter['strainer'] = SoupStrainer(name, attrs)
+  return soup_filter
+
+def match_soup_filter(soup_filter, el):
+  if soup_filter['selector']:
+    return soup_filter['selector'].match(el)
+  return soup_filter['strainer'].match(el)
+
+def find_soup_filter_elements(soup_filter, soup):
+  if soup_filter['selector']:
+    elements = soup_filter['selector'].select(soup)
+    if soup_filter['parent']:
+      elements = [el.find_parent(soup_filter['parent']) for el in elements]
+    return elements
+  return soup.find_all(soup_filter['name'], attrs=soup_filter['attrs'], recursive=soup_filter['recursive'])
+
+def parse_soup_fragment(new_html):
+  return list(BeautifulSoup(new_html, 'html.parser').contents)
+
+def copy_soup_fragment(fragment):
+  return [copy.copy(it) for it in fragment]
+
+def apply_soup_rule(rule, el, soup):
+  phase = rule['phase']
+  it = rule['rule']
+  if phase == 'rename':
+    if 'old' not in it:
+      el.name = it['name']
+      return
+    if 'tag' in it['new']:
+      el.name = it['new']['tag']
+    if 'before' in it['new']:
+      el.string = it['new']['before'] + el.string
+    if 'after' in it['new']:
+      el.string += it['new']['after']
+    if 'attrs' in it['new']:
+      for key, val in el.attrs.copy().items():
+        if key == 'href' or key == 'src':
+          continue
+        elif 'keep_attrs' in it['old'] and key in it['old']['keep_attrs']:
+          continue
+        else:
+          del el[key]
+      for key, val in it['new']['attrs'].items():
+        if el.get(key):
+          el[key] = val + el[key]
+        else:
+          el[key] = val
+  elif phase == 'replace':
+    new_els = copy_soup_fragment(rule['fragment'])
+    if new_els:
+      el.replace_with(*new_els)
+    else:
+      el.extract()
+  elif phase == 'insert_after':
+    el.insert_after(*copy_soup_fragment(rule['fragment']))
+  elif phase == 'insert_before':
+    el.insert_before(*copy_soup_fragment(rule['fragment']))
+  elif phase == 'decompose':
+    el.decompose()
+  elif phase == 'unwrap':
+    el.unwrap()
+  elif phase == 'wrap':
+    new_el = soup.new_tag(it['new']['tag'])
+    if it['new'].get('attrs'):
+      new_el.attrs = it['new']['attrs'].copy()
+    el.wrap(new_el)
+  elif phase == 'clear_attrs':
+    if el.name == 'a':
+      el.attrs = {key: val for key, val in el.attrs.items() if key in ['href', 'target']}
+    else:
+      el.attrs = {}
+
+def get_soup_rule_names(rule):
+  # Tag names a rule can create, which a later rule might be matching on
+  it = rule['rule']
+  if rule['phase'] == 'rename':
+    if 'old' in it:
+      return {it['new']['tag']} if it['new'].get('tag') else set()
+    return {it['name']}
+  elif rule['phase'] == 'wrap':
+    return {it['new']['tag']}
+  return set()
+
+def get_soup_rule_renamed(rule):
+  # The filter of the elements a rule renames (moving them away from rules on their old tag), or None
+  it = rule['rule']
+  if rule['phase'] == 'rename' and ('old' not in it or it['new'].get('tag')):
+    return rule['filter']
+  return None
+
+def is_soup_filter_overlapping(filter_a, filter_b):
+  # False only if the two filters can't match the same element going by tag name
+  if filter_a['selector'] or filter_b['selector']:
+    return True
+  names = []
+  for name in (filter_a['name'], filter_b['name']):
+    if isinstance(name, str):
+      names.append({name})
+    elif isinstance(name, list):
+      names.append(set(name))
+    else:
+      # Any tag (attrs only) or a regex
+      return True
+  return bool(names[0] & names[1])
+
+def is_soup_rule_writing_attrs(rule):
+  it = rule['rule']
+  if rule['phase'] == 'rename':
+    return 'old' in it and 'attrs' in it['new']
+  elif rule['phase'] == 'wrap':
+    return bool(it['new'].get('attrs'))
+  return rule['phase'] == 'clear_attrs'
+
+def is_soup_rule_dependent(rule, names, fragments, attrs_written, renamed):
+  # True if the rule might match differently because of an earlier rule's changes
+  soup_filter = rule['filter']
+  if soup_filter['selector'] or not soup_filter['recursive']:
+    return True
+  if any(is_soup_filter_overlapping(soup_filter, it) for it in renamed):
+    return True
+  if attrs_written and soup_filter['attrs']:
+    return True
+  if names:
+    if not isinstance(soup_filter['name'], (str, list)) or names.intersection([soup_filter['name']] if isinstance(soup_filter['name'], str) else soup_filter['name']):
+      return True
+  for fragment in fragments:
+    for it in fragment:
+      if isinstance(it, Tag) and (match_soup_filter(soup_filter, it) or any(match_soup_filter(soup_filter, el) for el in it.find_all(True))):
+        return True
+  return False
+
+@functools.lru_cache(maxsize=2048)
+def compile_soup_program(rules_json):
+  program = {
+    "rules": [],
+    "single_pass": True
+  }
+  names = set()
+  fragments = []
+  attrs_written = False
+  renamed = []
+  for phase, rules in json.loads(rules_json):
+    for it in rules:
+      rule = {
+        "phase": phase,
+        "rule": it,
+        "filter": compile_soup_filter(it['old'] if phase == 'rename' and 'old' in it else it)
+      }
+      if not rule['filter']:
+        continue
+      if program['rules'] and is_soup_rule_dependent(rule, names, fragments, attrs_written, renamed):
+        program['single_pass'] = False
+      if 'new_html' in it:
+        rule['fragment'] = parse_soup_fragment(it['new_html'])
+        fragments.append(rule['fragment'])
+      names |= get_soup_rule_names(rule)
+      attrs_written = attrs_written or is_soup_rule_writing_attrs(rule)
+      if get_soup_rule_renamed(rule):
+        renamed.append(get_soup_rule_renamed(rule))
+      program['rules'].append(rule)
+
+  # For the single pass: the union of the selectors, and the tag/attrs filters indexed by tag name
+  selectors = [rule['filter']['selector_text'] for rule in program['rules'] if rule['filter']['selector']]
+  program['selector'] = soupsieve.compile(', '.join(selectors)) if selectors else None
+  program['tag_rules'] = {}
+  program['any_rules'] = []
+  for i, rule in enumerate(program['rules']):
+    if rule['filter']['selector']:
+      continue
+    if isinstance(rule['filter']['name'], str):
+      program['tag_rules'].setdefault(rule['filter']['name'], []).append(i)
+    else:
+      program['any_rules'].append(i)
+  return program
+
+def get_soup_program(site_json, phases=soup_program_phases):
+  rules = [(phase, site_json[phase]) for phase in phases if site_json.get(phase) and isinstance(site_json[phase], list)]
+  if not rules:
+    return None
+  return compile_soup_program(json.dumps(rules, sort_keys=True))
+
+def match_soup_program(program, soup):
+  matches = [[] for rule in program['rules']]
+  if program['selector']:
+    for el in program['selector'].select(soup):
+      for i, rule in enumerate(program['rules']):
+        if rule['filter']['selector'] and rule['filter']['selector'].match(el):
+          matches[i].append(el.find_parent(rule['filter']['parent']) if rule['filter']['parent'] else el)
+  if program['tag_rules'] or program['any_rules']:
+    for el in soup.find_all(True):
+      for i in program['tag_rules'].get(el.name, []) + program['any_rules']:
+        soup_filter = program['rules'][i]['filter']
+        if (soup_filter['recursive'] or el.parent is soup) and soup_filter['strainer'].match(el):
+          matches[i].append(el)
+  return matches
+
+def run_soup_program(program, soup):
+  if not program:
+    return soup
+  if program['single_pass']:
+    matches = match_soup_program(program, soup)
+  for i, rule in enumerate(program['rules']):
+    if program['single_pass']:
+      elements = matches[i]
+    else:
+      elements = find_soup_filter_elements(rule['filter'], soup)
+    applied = set()
+    for el in elements:
+      # Skip duplicates (several matches can share a parent) and anything an earlier rule already removed
+      if el is None or id(el) in applied or not any(it is soup for it in el.parents):
+        continue
+      applied.add(id(el))
+      apply_soup_rule(rule, el, soup)
+  return soup
+
+def apply_site_rules(soup, site_json, phases=soup_program_phases):
+  return run_soup_program(get_soup_program(site_json, phases), soup)
+
 def calc_duration(total_seconds, include_sec=False, time_format=','):
   m, s = divmod(int(total_seconds), 60)
   h, m = divmod(m, 60)
@@ -2733,6 +4556,7 @@ def get_bing_cache(url, slug=-1, save_debug=False):
   return ''
 
 def search_for(search_query):
+  from duckduckgo_search import DDGS
   try:
     results = DDGS().text(search_query, max_results=10)
     return results
@@ -2865,6 +4689,7 @@ def get_stock_price(stock_sym, stock_name):
 
 
 def add_stock_chart(stock_sym, save_debug=False):
+  import pygal, pygal.style
   chart_svg = ''
   dt = datetime.now()
   if dt.weekday() == 6: